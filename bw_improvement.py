@@ -7,7 +7,7 @@ from mininet.net import Mininet
 from mininet.log import lg, output
 from mininet.node import CPULimitedHost
 from mininet.link import TCLink
-from mininet.util import irange, custom, quietRun, dumpNetConnections
+from mininet.util import irange, custom, quietRun, dumpNetConnections, numCores
 from mininet.cli import CLI
 
 from time import sleep, time
@@ -24,7 +24,17 @@ from pyx.graph import axis
 import sys
 import os
 import re
+import json
+import threading
+from util import readiness
 from util.monitor import monitor_devs_ng
+from util.collector import Collector
+from util.topo import MultiClientTopo, PairsTopo
+from util.parallel import CPUWatch, run_parallel
+from util.sweep import Sweep, load_spec, find_spec
+from util.cache import ResultCache, file_digest, kernel
+from util.journal import Journal
+from util import linkconf
 
 
 parser = argparse.ArgumentParser(description="Baseline tests")
@@ -65,6 +75,75 @@ parser.add_argument('--time', '-t',
                     help="Duration of the experiment.",
                     default=60)
 
+parser.add_argument('--spacing',
+                    type=float,
+                    help="Extra seconds between consecutive fetches of a batch, "
+                         "after each one's connection has closed",
+                    default=0.0)
+
+parser.add_argument('--workload',
+                    choices=['single', 'load'],
+                    help="One fetch at a time, or concurrent fetchers under contention",
+                    default='single')
+
+parser.add_argument('--concurrency',
+                    type=int,
+                    help="Number of concurrent fetchers of the load workload",
+                    default=8)
+
+parser.add_argument('--arrival-rate',
+                    type=float,
+                    help="Poisson fetch arrivals per second of the load workload (0 for closed-loop)",
+                    default=0.0)
+
+parser.add_argument('--engine',
+                    choices=['single', 'threaded', 'prefork', 'eventloop'],
+                    help="Server engine (default: eventloop for the load workload "
+                         "and the multiclient sweep, else single)",
+                    default=None)
+
+parser.add_argument('--sweep',
+                    choices=['serial', 'multiclient', 'inplace', 'parallel'],
+                    help="Run a figure's values one network at a time, as parallel clients of one network, "
+                         "by reshaping one network's bottleneck between values, "
+                         "or on several isolated client/server pairs at once",
+                    default='serial')
+
+parser.add_argument('--spec',
+                    action='append',
+                    help="Sweep spec to run, by name in --sweeps or by path (repeatable; default: figures 1-3)",
+                    default=None)
+
+parser.add_argument('--sweeps',
+                    help="Directory of sweep specs",
+                    default="sweeps")
+
+parser.add_argument('--cache',
+                    help="Directory of cached measurements (default: DIR/cache)",
+                    default=None)
+
+parser.add_argument('--no-cache',
+                    action='store_true',
+                    help="Measure every point, without reading or writing the cache")
+
+parser.add_argument('--replot',
+                    action='store_true',
+                    help="Don't measure anything, graph the sweeps from the cache")
+
+parser.add_argument('--resume',
+                    action='store_true',
+                    help="Skip the points an interrupted run of the same sweeps already journaled")
+
+parser.add_argument('--parallel',
+                    type=int,
+                    help="Client/server pairs of the parallel sweep (default: one per core)",
+                    default=None)
+
+parser.add_argument('--cpu',
+                    type=float,
+                    help="Fraction of a core each host of the parallel sweep gets",
+                    default=0.5)
+
 
 # Expt parameters, setup stuff
 args = parser.parse_args()
@@ -206,49 +285,132 @@ def verify_bandwidth(net):
 
 
 
-def query_server(client, serv_ip, run_num, target=args.target):
+def query_server_batch(client, serv_ip, num_runs, target=args.target):
+    "Fetch the target num_runs times, returning the flow completion times"
+
+    # a single client process does every run, each once the last
+    # one's connection has closed, and all the results come back in
+    # one read
+    fetch_res = client.cmd(batch_command(serv_ip, num_runs, target))
+    return parse_fcts(fetch_res)
+
+
+def batch_command(serv_ip, num_runs, target=args.target):
+    "Client command line fetching the target num_runs times"
+    return 'python lib/TimedHTTPClient.py -n %d -s %f --settle http://%s:8000/%s' % \
+            (num_runs, args.spacing, serv_ip, target)
+
+
+def parse_records(fetch_res):
+    "The JSON records in the client's output"
+    records = []
+    for line in fetch_res.split('\n'):
+        line = line.strip()
+        if line.startswith('{'):
+            records.append(json.loads(line))
+    return records
+
+
+def fcts(records):
+    """Flow completion time of each fetch in RECORDS, None for the ones
+       that failed or didn't get a 2xx response"""
+    times = []
+    failed = []
+    for record in records:
+        if 200 <= record.get('status', 0) < 300:
+            times.append(record['fct'])
+        else:
+            times.append(None)
+            failed.append(record.get('error') or 'status %s' % record.get('status'))
+
+    if failed:
+        cprint("%d of %d fetches failed, first with %s" % (len(failed), len(records), failed[0]), "red")
+    return times
+
+
+def parse_fcts(fetch_res):
+    "Flow completion times out of the client's output"
+    return fcts(parse_records(fetch_res))
+
 
-    # execute command!
-    wget_res = client.cmd('time (wget %s:8000/%s -o /tmp/wget%d -P /tmp/%d) 2> %s/wgettime%d ' % 
-            (serv_ip, target, run_num, run_num, args.dir, run_num))
+def query_server_load(client, serv_ip, num_runs, target=args.target):
+    "Fetch the target num_runs times from each of args.concurrency fetchers at once"
 
-    # extract and return real time as reported by time
-    a = open(r"%s/wgettime%d" % (args.dir, run_num), "r")
-    for line in a:
-        if line.startswith("real"):
-            return float( re.findall("\d*\\.\d*", line)[0] ) 
+    # closed-loop unless an arrival rate is given, in which case the
+    # same total number of fetches arrive as a poisson process
+    fetch_res = client.cmd('python lib/TimedHTTPClient.py -n %d -s %f -c %d -r %f --settle --summary http://%s:8000/%s' %
+            (num_runs * args.concurrency, args.spacing, args.concurrency,
+             args.arrival_rate, serv_ip, target))
 
-    # return nothing if nothing is found
-    return None
+    records = parse_records(fetch_res)
+    summary = ([r for r in records if r.get('summary')] or [{}])[-1]
+    times = fcts([r for r in records if not r.get('summary')])
 
+    return times, summary
 
-def start_server(net):
+
+def server_engine():
+    "The server engine this run's workload and sweep mode call for"
+    if args.engine:
+        return args.engine
+    # many clients at once need an engine that serves them concurrently
+    if args.workload == 'load' or args.sweep == 'multiclient':
+        return 'eventloop'
+    return 'single'
+
+def start_server(net, name='server'):
     "Start the simple python http server"
 
-    server = net.getNodeByName('server')
+    server = net.getNodeByName(name)
     cprint("starting the server...", "green")
 
-    result = server.cmd('nohup python -m lib/SimpleVarLengthHTTPServer > %s/serverlog.txt &' % args.dir)
+    engine = server_engine()
+    logfile = 'serverlog.txt' if name == 'server' else 'serverlog-%s.txt' % name
+    result = server.cmd('nohup python -m lib/SimpleVarLengthHTTPServer 8000 --engine %s > %s/%s &' %
+            (engine, args.dir, logfile))
+
+    # wait for the server to spin up
+    if not readiness.wait_listening(server, 8000):
+        cprint('SERVER NEVER STARTED LISTENING, EXITING NOW!!!', 'red')
+        net.stop()
+        sys.exit(1)
+
+def change_cwnd(server, serv_route, dst_ip, cwnd):
+    "Set the server's initial cwnd once its earlier connections are done"
+
+    if not readiness.wait_quiet(server, 8000):
+        cprint("%s still has open connections, going ahead anyway" % server.name, "red")
 
-    # Have to sleep for a little to allow the server to spin up
-    # TODO - can we make this a little less hacky?
-    sleep(1)
+    serv_res = server.cmd("ip route change %s initcwnd %d cwnd %d" % (serv_route, cwnd, cwnd))
+    server.cmd("ip route flush cache")
+
+    if not readiness.wait_route(server, dst_ip, cwnd):
+        cprint(">>>>>>> ROUTE TO %s DOESN'T CARRY INITCWND %d! <<<<<<<<<<" % (dst_ip, cwnd), "red")
+
+# the collector copying /proc/net/tcpprobe, while tcpprobe is running
+collector = None
 
 def start_tcpprobe():
+    global collector
     os.system("rmmod tcp_probe &>/dev/null; modprobe tcp_probe;")
-    Popen("cat /proc/net/tcpprobe > %s/tcp_probe.txt" % args.dir, shell=True)
+    collector = Collector(tcpprobe=dict(fname='%s/tcp_probe.txt' % args.dir))
+    collector.start()
 
 def stop_tcpprobe():
-    os.system("killall -9 cat; rmmod tcp_probe &>/dev/null;")
+    global collector
+    # returns once everything read is in tcp_probe.txt
+    collector.quit()
+    collector = None
+    os.system("rmmod tcp_probe &>/dev/null;")
 
-def increase_client_rwnd(net):
+def increase_client_rwnd(net, name='client'):
     """
     Simple set of commands to increase the receivers
     initial receieve window high enough to never be the
     initial limiting factor
     """
 
-    client = net.getNodeByName('client')
+    client = net.getNodeByName(name)
     cli_route = client.cmd("ip route")
     cli_route = cli_route.replace('\n', ' ')
     cli_res = client.cmd("ip route change %s initcwnd 45 initrwnd 45" % (cli_route))
@@ -263,15 +425,11 @@ def verify_cwnd(net, cwnd):
     server = net.getNodeByName('server')
     client = net.getNodeByName('client')
 
-    # Start tcpprobe, server, then client
+    # Start tcpprobe, then pull a 3 second long flow off the
+    # (already running) var length server
     start_tcpprobe()
     cprint("verifying the initial cwnd.... ", "green")
-    server.cmd("iperf -s -Z reno -p 5001 > /dev/null &")
-    iperf_res = client.cmd("iperf -c %s -Z reno -p 5001 -t 3 > /dev/null" % server.IP())
-    sleep(3)
-    
-    # stop iperf once client is done
-    os.system("killall -9 iperf")
+    client.cmd("wget -q -O /dev/null %s:8000/stream/3" % server.IP())
     stop_tcpprobe()
 
     # verify the initial cwnd
@@ -286,14 +444,15 @@ def verify_cwnd(net, cwnd):
     if abs(cwnd - obs_cwnd) > 1:
         cprint(">>>>>>> ITS TOO FAR FROM THE SET VALUE! <<<<<<<<<<", "red")
 
-def run_simple_exp(net, num_runs):
-    "Run experiment"
+def run_simple_exp(net, num_runs, client='client', server='server',
+                   cwnds=[3, 10], target=args.target):
+    "Run experiment, returning the flow completion times for each cwnd"
 
     seconds = args.time
 
     # Get server and client
-    server = net.getNodeByName('server')
-    client = net.getNodeByName('client')
+    server = net.getNodeByName(server)
+    client = net.getNodeByName(client)
     server.cmd("clear")
     client.cmd("clear")
     serv_ip = server.IP()
@@ -301,25 +460,23 @@ def run_simple_exp(net, num_runs):
     serv_route = server.cmd("ip route")
     cli_route = client.cmd("ip route")
     serv_route = serv_route.replace('\n', ' ')
+    # drop the windows an earlier run on this network left on the route,
+    # or the change below would carry them twice
+    serv_route = re.sub(r' (initcwnd|cwnd) \d+', '', serv_route)
     cli_route = cli_route.replace('\n', ' ')
 
     # have the client get the server's web page
     cprint("starting the client's requests", "green")
 
-    cwnd_times = []
-    latencies = []
-    cwnds = [3, 10]
+    cwnd_times = {}
 
     for cwnd in cwnds:
 
         #change congestion windows
-        sleep(0.5)
         print "testing for cwnd of size %d ...." % cwnd
 
         server.cmd("clear")
-        serv_res = server.cmd("ip route change %s initcwnd %d cwnd %d" % (serv_route, cwnd, cwnd))
-        #print "server results from ip route change ..... ", serv_res
-        server.cmd("ip route flush cache")
+        change_cwnd(server, serv_route, cli_ip, cwnd)
 
         # verify cwnds 
         #serv_v = server.cmd("ip route")
@@ -330,98 +487,57 @@ def run_simple_exp(net, num_runs):
         #print "client route = ", cli_r
         #verify_cwnd(net, cwnd) # TODO - doesn't really work
 
-        # test wget times
-        times = []
-        for r in range(num_runs):
-            cprint("%d ..." % (r + 1), "green")
-
-            times.append( query_server(client, serv_ip, r) )
-
-            sleep(0.5) # TODO - why are we getting those spurious times? this works fine
+        # test fetch times
+        if args.workload == 'load':
+            cprint("%d runs from each of %d fetchers ..." % (num_runs, args.concurrency), "green")
+            times, summary = query_server_load(client, serv_ip, num_runs, target)
+            print "fct percentiles -- p50 %.1f p90 %.1f p99 %.1f ms, %d errors" % \
+                (1000 * summary.get('p50', 0), 1000 * summary.get('p90', 0),
+                 1000 * summary.get('p99', 0), summary.get('errors', 0))
+        else:
+            cprint("%d runs of %s ..." % (num_runs, target), "green")
+            times = query_server_batch(client, serv_ip, num_runs, target)
 
-        avg_time = sum(times)/len(times)
-        latency = avg_time * 1000
         print times
 
-        cwnd_times.append(avg_time)
-        latencies.append(latency)
+        cwnd_times[cwnd] = times
 
-    absolute_improve = latencies[0] - latencies[1]
-    percent_improve = 100*( cwnd_times[0]/cwnd_times[1] - 1 )
-    print "absolute improvement", absolute_improve, "percentage improvement", percent_improve
+    return cwnd_times
 
-    return (absolute_improve, percent_improve)
+def run_multiclient_exp(net, topo, points, cwnds=[3, 10]):
+    """Run experiment from every client of a MultiClientTopo at once,
+       each doing the (num_runs, target) of POINTS at its index"""
 
-def run_figure7_exp(net, num_runs):
-    "Run experiment"
+    servers = [net.getNodeByName(name) for name in topo.servers]
+    pairs = [(net.getNodeByName(c), net.getNodeByName(s)) for c, s in topo.pairs()]
+    serv_routes = [server.cmd("ip route").replace('\n', ' ') for server in servers]
 
-    seconds = args.time
+    cprint("starting %d clients' requests" % len(pairs), "green")
 
-    # Get server and client
-    server = net.getNodeByName('server')
-    client = net.getNodeByName('client')
-    server.cmd("clear")
-    client.cmd("clear")
-    serv_ip = server.IP()
-    cli_ip = client.IP()
-    serv_route = server.cmd("ip route")
-    cli_route = client.cmd("ip route")
-    serv_route = serv_route.replace('\n', ' ')
-    cli_route = cli_route.replace('\n', ' ')
-
-    # have the client get the server's web page
-    cprint("starting the client's requests", "green")
-
-    cwnd_wget_times = []
-    cwnds = [3, 10]
-    filesizes = [2, 3, 4, 7, 10, 15, 30, 50, 250]
+    # cwnd_times[i] is client i's flow completion times for each cwnd
+    cwnd_times = [{} for pair in pairs]
 
     for cwnd in cwnds:
 
         #change congestion windows
-        sleep(0.5)
         print "testing for cwnd of size %d ...." % cwnd
 
-        server.cmd("clear")
-        serv_res = server.cmd("ip route change %s initcwnd %d cwnd %d" % (serv_route, cwnd, cwnd))
-        #print "server results from ip route change ..... ", serv_res
-        server.cmd("ip route flush cache")
-
-        # change up filesize to get
-        wget_times = []
-        for filesize in filesizes:
-
-            # test wget times
-            times = []
-            for r in range(num_runs):
-                cprint("%d ..." % (r + 1), "green")
-
-                times.append( query_server(client, serv_ip, r, target=filesize) )
+        for server, serv_route in zip(servers, serv_routes):
+            cli_ip = [c for c, s in pairs if s is server][0].IP()
+            change_cwnd(server, serv_route, cli_ip, cwnd)
 
-                sleep(0.5) # TODO - why are we getting those spurious times? this works fine
+        # every client runs its batch at the same time, then we
+        # collect them in turn
+        cprint("every client's runs ...", "green")
+        for (client, server), (num_runs, target) in zip(pairs, points):
+            client.sendCmd(batch_command(server.IP(), num_runs, target))
+        for i, (client, server) in enumerate(pairs):
+            times = parse_fcts(client.waitOutput())
+            print client.name, times
+            cwnd_times[i][cwnd] = times
 
-            avg_time = sum(times)/len(times)
-            wget_times.append(1000*avg_time) #keep it in ms
+    return cwnd_times
 
-        cwnd_wget_times.append(wget_times)
-
-    # now, figure out the absolute and percentage improvements
-    abs_improvs = []
-    pct_improvs = []
-    
-    for i in range(0, len(filesizes)):
-        abs_improvs.append(int(cwnd_wget_times[0][i] - cwnd_wget_times[1][i]))
-        pct_improvs.append(100*( cwnd_wget_times[0][i]/cwnd_wget_times[1][i] - 1 ))
-
-    #save_graph(filesizes, abs_improvs, pct_improvs,'Figure 7: number of Segments vs Improvement')
-
-    title = 'Figure 4'
-    x_units = 'Bandwidth (Kbps)'
-    y_units = 'Improvement (ms)'
-
-    save_graph(filesizes, abs_improvs, pct_improvs, title, x_units, y_units,'figure4')
- 
-    
 def save_graph(bw_vals, abs_improv, pct_improv,title, x_units, y_units,filename):
 
     assert(len(bw_vals) == len(abs_improv))
@@ -471,96 +587,286 @@ def save_graph(bw_vals, abs_improv, pct_improv,title, x_units, y_units,filename)
     g.writeEPSfile(RESULTS_DIR + '%s' % filename)
     g.writePDFfile(RESULTS_DIR + '%s' % filename)
 
-def figure5(graph_num):
-    "Create and run RTT/bandwidth/BDP experiments, as in figure 5"
-    start = time()
+def start_simple_net(lconfig=None):
+    "Start a SimpleTopo mininet with the bottleneck LCONFIG, and its server"
 
-    abs_improvs = []
-    pct_improvs = []
-    variables = []
-    
-    title = 'Figure %d' % graph_num
-    filename = 'figure%d' % graph_num
-    x_units = 'x units'
-    y_units = 'y units'
-
-    if graph_num == 1:
-        x_units = 'RTT (ms)'
-        y_units = 'Improvement (ms)'
-        variables = [20, 50, 100, 200, 500, 1000, 3000]
-    elif graph_num == 2:
-        x_units = 'Bandwidth (kbps)'
-        y_units = 'Improvement (ms)'
-        variables = [56, 256, 512, 1000, 2000, 3000, 5000, 10000]
-        #variables = [3000, 5000, 10000]
-    elif graph_num == 3:
-        x_units = 'BDP (bytes)'
-        y_units = 'Improvement (ms)'
-        # tuples are (B/W (KiloBytes per second), RTT (ms))
-	# The paper says BDP is in bytes, so it must be the case that its KB
-        variables = [(20, 50), (50, 100), (100, 100), (250, 200), (250, 400)]
-        #variables = [(50, 100), (100, 100), (250, 200), (250, 400)]
-    elif graph_num == 4:
-        variables = [1] #dummy var
-
-    for var in variables:
-
-        if graph_num == 1:
-            cprint("Testing network with a RTT of %s" % var, "blue")
-            topo = SimpleTopo(delay='%dms' % (var/2))
-        elif graph_num == 2:
-            cprint("Testing network with bottleneck bandwidth of %f kbps" % var, "blue")
-            topo = SimpleTopo(bw = var/1000.0)
-        elif graph_num == 3:
-            cprint("Testing network with bottleneck bandwidth of %f kbps" % var[0], "blue")
-            cprint("and a RTT of %d ms" % var[1], "blue")
-            delay = "%dms" % (var[1]/2)
-            topo = SimpleTopo(bw = var[0]/125.0, delay=delay) #make sure its KBps, not Kbps
-        elif graph_num == 4:
-            topo = SimpleTopo() #use default args
-
-        # create very simple mininet
-        net = Mininet(topo=topo, link=TCLink)
-        net.start()
+    # create very simple mininet
+    net = Mininet(topo=SimpleTopo(**(lconfig or {})), link=TCLink)
+    net.start()
 
-        # increase clients rwnd before anything else
-        increase_client_rwnd(net)
+    # increase clients rwnd before anything else
+    increase_client_rwnd(net)
 
-    	if args.cli:
-            # Run CLI before experiment
-            CLI(net)
+    if args.cli:
+        # Run CLI before experiment
+        CLI(net)
 
-        # test stuff before starting
-        cprint("*** Dumping network connections:", "green")
-        dumpNetConnections(net)
+    # test stuff before starting
+    cprint("*** Dumping network connections:", "green")
+    dumpNetConnections(net)
 
-        cprint("*** Testing connectivity", "blue")
-        net.pingAll()
+    cprint("*** Testing connectivity", "blue")
+    net.pingAll()
 
-        # start server
-        start_server(net)
+    # start server
+    start_server(net)
 
-        # run experiement
-        if graph_num == 4:
-            run_figure7_exp(net, args.numruns)
-            return # terminate experiment
-        else:
-            (abs_i, pct_i) = run_simple_exp(net, args.numruns)
+    return net
+
+def measure_serial(todo, done):
+    """Measure each (point, cwnds) of TODO on a mininet of its own,
+       kept up for the next point when that has the same link, and
+       call done(point, samples) as each finishes"""
+
+    net = None
+    link = None
+
+    for point, cwnds in todo:
 
-        # end this instance of mininet
+        if net is None or point.link != link:
+            if net is not None:
+                # end this instance of mininet
+                net.stop()
+            link = point.link
+            net = start_simple_net(link)
+
+        cprint("Testing %s" % point, "blue")
+        done(point, run_simple_exp(net, point.runs, cwnds=cwnds, target=point.target))
+
+    if net is not None:
         net.stop()
 
-        abs_improvs.append(abs_i)
-        pct_improvs.append(pct_i)
+def measure_multiclient(todo, done):
+    """Measure every (point, cwnds) of TODO in one mininet, with a client
+       per point behind an access link shaped like its bottleneck, and
+       call done(point, samples) for each once they all finish"""
+
+    topo = MultiClientTopo(clients=[point.link for point, cwnds in todo])
+
+    net = Mininet(topo=topo, link=TCLink)
+    net.start()
+
+    # increase clients rwnd before anything else
+    for name in topo.clients:
+        increase_client_rwnd(net, name)
+
+    if args.cli:
+        # Run CLI before experiment
+        CLI(net)
+
+    # test stuff before starting
+    cprint("*** Dumping network connections:", "green")
+    dumpNetConnections(net)
+
+    cprint("*** Testing connectivity", "blue")
+    net.pingAll()
+
+    # start server
+    start_server(net, topo.servers[0])
+
+    # the clients share their server's cwnd, so all of them run every
+    # cwnd any of them is missing
+    cwnds = []
+    for point, point_cwnds in todo:
+        cwnds += [c for c in point_cwnds if c not in cwnds]
+
+    samples = run_multiclient_exp(net, topo, [(point.runs, point.target) for point, c in todo], cwnds)
+    net.stop()
+
+    for (point, point_cwnds), times in zip(todo, samples):
+        done(point, times)
+
+def measure_inplace(todo, done):
+    """Measure every (point, cwnds) of TODO in one mininet, reshaping
+       the server's bottleneck link with tc between points, and call
+       done(point, samples) as each finishes"""
+
+    net = start_simple_net()
+    client = net.getNodeByName('client')
+    serv_ip = net.getNodeByName('server').IP()
+    intfs = linkconf.link_intfs(net, 'server', 's1')
+    link = None
+
+    for point, cwnds in todo:
+
+        cprint("Testing %s" % point, "blue")
+
+        if point.link != link:
+            link = point.link
+            linkconf.reconfigure(intfs, **link)
+
+            # don't measure anything until the new shape is really in place
+            try:
+                rtt = linkconf.verify(intfs, client, serv_ip, **link)
+            except linkconf.LinkConfigError, e:
+                cprint('LINK RECONFIGURATION FAILED, EXITING NOW!!! %s' % e, 'red')
+                net.stop()
+                sys.exit(1)
+            cprint("bottleneck reshaped, ping rtt %.1f ms" % rtt, "green")
+
+        done(point, run_simple_exp(net, point.runs, cwnds=cwnds, target=point.target))
+
+    net.stop()
+
+def measure_parallel(todo, done):
+    """Measure the (point, cwnds) of TODO over isolated client/server pairs
+       of one mininet, a point per pair at a time, each pair pinned to a
+       core, and call done(point, samples) as each finishes"""
+
+    cores = numCores()
+    slots = min(args.parallel or cores, len(todo))
+    # CPULimitedHost takes a fraction of the whole system
+    cpu = args.cpu / cores
+
+    topo = PairsTopo(slots, cpu=cpu, cores=range(cores))
+    net = Mininet(topo=topo, host=CPULimitedHost, link=TCLink)
+    net.start()
+
+    if args.cli:
+        # Run CLI before experiment
+        CLI(net)
+
+    # test stuff before starting
+    cprint("*** Dumping network connections:", "green")
+    dumpNetConnections(net)
+
+    pairs = zip(topo.clients, topo.servers, topo.pair_switches)
+    for client, server, switch in pairs:
+        # increase clients rwnd before anything else
+        increase_client_rwnd(net, client)
+        cprint("*** Testing connectivity of %s and %s" % (client, server), "blue")
+        net.ping([net.getNodeByName(client), net.getNodeByName(server)])
+        start_server(net, server)
+
+    def run_point(pair, (point, cwnds)):
+        (client, server, switch) = pair
+        intfs = linkconf.link_intfs(net, server, switch)
+        linkconf.reconfigure(intfs, **point.link)
+        linkconf.verify(intfs, net.getNodeByName(client),
+                        net.getNodeByName(server).IP(), **point.link)
+
+        watch = CPUWatch([net.getNodeByName(client), net.getNodeByName(server)], cpu)
+        times = run_simple_exp(net, point.runs, client, server, cwnds, point.target)
+        cpu_report = watch.stop()
+        done(point, times)
+        return cpu_report
+
+    reports = run_parallel(pairs, todo, run_point)
+    net.stop()
+
+    # report every point's CPU headroom, flagging the ones measured on
+    # a CPU-starved host; failed points are left for a retry
+    for (point, cwnds), cpu_report in zip(todo, reports):
+        if isinstance(cpu_report, Exception):
+            cprint("%s FAILED: %s" % (point, cpu_report), "red")
+            continue
+        for name, use in sorted(cpu_report.items()):
+            line = "%s: %s used %.2f cores, %d%% headroom" % \
+                (point, name, use['cores'], 100 * use['headroom'])
+            if use['starved']:
+                cprint(line + " -- CPU STARVED, try fewer --parallel pairs", "red")
+            else:
+                cprint(line, "cyan")
+
+SWEEP_MODES = {'serial': measure_serial,
+               'multiclient': measure_multiclient,
+               'inplace': measure_inplace,
+               'parallel': measure_parallel}
+
+def measurement_context():
+    "Everything besides the job itself that a point's samples depend on"
+    client = {'code': file_digest('lib/TimedHTTPClient.py'),
+              'workload': args.workload,
+              'spacing': args.spacing}
+    if args.workload == 'load':
+        client['concurrency'] = args.concurrency
+        client['arrival_rate'] = args.arrival_rate
+    return {'kernel': kernel(),
+            'server': {'code': file_digest('lib/SimpleVarLengthHTTPServer.py'),
+                       'engine': server_engine()},
+            'client': client,
+            'sweep': args.sweep}
+
+context = measurement_context()
+
+# flow completion times of every job measured so far, by job key, so
+# points shared between sweeps, or measured by an earlier run in the
+# same context, are only measured once
+if args.no_cache:
+    results = {}
+else:
+    results = ResultCache(args.cache or os.path.join(args.dir, 'cache'), context)
+
+def load_sweep(name):
+    "The sweep of the spec NAME, filled in from the command line"
+    spec = load_spec(find_spec(name, args.sweeps))
+    return Sweep(spec,
+                 link={'bw': args.bw_net, 'delay': args.latency, 'loss': args.loss},
+                 target=args.target,
+                 runs=args.numruns)
+
+def run_sweep(sweep):
+    "Measure the points of SWEEP that haven't been yet, and graph it"
+    start = time()
+
+    measure = SWEEP_MODES[args.sweep]
+    partial = {}
+
+    # every job is journaled the moment it finishes, so --resume can
+    # pick up where an interrupted run left off; replotting only reads it
+    journal = Journal(os.path.join(args.dir, 'journal', sweep.name + '.jsonl'),
+                      args.resume or args.replot, context)
+    for job, times in journal.entries.items():
+        if job not in results:
+            results[job] = times
+
+    lock = threading.Lock()
+    def done(point, samples):
+        with lock:
+            for cwnd, times in samples.items():
+                # keep failed runs out, so a retry measures them again
+                if times and None not in times:
+                    results[point.job(cwnd)] = times
+                    journal.append(point.job(cwnd), times)
+                else:
+                    partial[point.job(cwnd)] = times
+
+    # replotting measures nothing, it only graphs what's cached or journaled
+    attempts = 0 if args.replot else sweep.retries + 1
+
+    for attempt in range(attempts):
+        todo = sweep.plan(results)
+        if not todo:
+            break
+        cprint("*** %s: measuring %d of %d points" % (sweep.name, len(todo), len(sweep.points)), "yellow")
+        measure(todo, done)
+
+    journal.close()
+
+    # whatever still failed after the retries is used as it is
+    for job, times in partial.items():
+        if job not in results and [t for t in times if t is not None]:
+            results[job] = times
 
     end = time()
     cprint("Experiment took %.3f seconds" % (end - start), "yellow")
 
-    # fixup the bdp x-axis before we graph if we are testing bdp
-    if graph_num == 3:
-        variables = [1000, 5000, 10000, 50000, 100000]
+    missing = sweep.plan(results)
+    if missing:
+        for point, cwnds in missing:
+            cprint("%s: no samples for %s at cwnds %s" % (sweep.name, point, cwnds), "red")
+        cprint('%s IS MISSING POINTS, EXITING NOW!!!' % sweep.name, 'red')
+        sys.exit(1)
+
+    (abs_improvs, pct_improvs) = sweep.improvements(results)
+    print "absolute improvements", abs_improvs, "percentage improvements", pct_improvs
 
-    save_graph(variables, abs_improvs, pct_improvs, title, x_units, y_units,filename)
+    save_graph(sweep.x_values, abs_improvs, pct_improvs, sweep.title,
+               sweep.x_units, sweep.y_units, sweep.output)
+
+def figure5(graph_num):
+    "Create and run RTT/bandwidth/BDP experiments, as in figure 5"
+    run_sweep(load_sweep('figure%d' % graph_num))
 
 def figure7():
     #rather not copy/paste code
@@ -571,6 +877,12 @@ def figure5_bandwidth_adjusted():
     figure5(5)
 
 def main():
+    # sweeps named on the command line, instead of the default figures
+    if args.spec:
+        for name in args.spec:
+            run_sweep(load_sweep(name))
+        return
+
     # comment in the figures from the initcwnd paper you want to reproduce
 
     #recreate latency vs fct improvement graph
@@ -587,4 +899,3 @@ def main():
 
 if __name__ == '__main__':
     main()
-
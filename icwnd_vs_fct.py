@@ -22,7 +22,10 @@ import pyx
 import sys
 import os
 import re
+import json
+from util import readiness
 from util.monitor import monitor_devs_ng
+from util.collector import Collector
 
 parser = argparse.ArgumentParser(description="Baseline tests")
 
@@ -58,6 +61,32 @@ parser.add_argument('--time', '-t',
                     help="Duration of the experiment.",
                     default=60)
 
+parser.add_argument('--spacing',
+                    type=float,
+                    help="Extra seconds between consecutive fetches of a batch, "
+                         "after each one's connection has closed",
+                    default=0.0)
+
+parser.add_argument('--workload',
+                    choices=['single', 'load'],
+                    help="One fetch at a time, or concurrent fetchers under contention",
+                    default='single')
+
+parser.add_argument('--concurrency',
+                    type=int,
+                    help="Number of concurrent fetchers of the load workload",
+                    default=8)
+
+parser.add_argument('--arrival-rate',
+                    type=float,
+                    help="Poisson fetch arrivals per second of the load workload (0 for closed-loop)",
+                    default=0.0)
+
+parser.add_argument('--engine',
+                    choices=['single', 'threaded', 'prefork', 'eventloop'],
+                    help="Server engine (default: eventloop for the load workload, else single)",
+                    default=None)
+
 
 # Expt parameters
 args = parser.parse_args()
@@ -197,20 +226,64 @@ def verify_bandwidth(net):
 
 
 
-def query_server(client, serv_ip, run_num):
+def query_server_batch(client, serv_ip, num_runs):
+    "Fetch the target num_runs times, returning the flow completion times"
+
+    # a single client process does every run, each once the last
+    # one's connection has closed, and all the results come back in
+    # one read
+    fetch_res = client.cmd('python lib/TimedHTTPClient.py -n %d -s %f --settle http://%s:8000/%s' %
+            (num_runs, args.spacing, serv_ip, args.target))
+
+    return parse_fcts(fetch_res)
+
+
+def parse_records(fetch_res):
+    "The JSON records in the client's output"
+    records = []
+    for line in fetch_res.split('\n'):
+        line = line.strip()
+        if line.startswith('{'):
+            records.append(json.loads(line))
+    return records
+
+
+def fcts(records):
+    """Flow completion time of each fetch in RECORDS, None for the ones
+       that failed or didn't get a 2xx response"""
+    times = []
+    failed = []
+    for record in records:
+        if 200 <= record.get('status', 0) < 300:
+            times.append(record['fct'])
+        else:
+            times.append(None)
+            failed.append(record.get('error') or 'status %s' % record.get('status'))
+
+    if failed:
+        cprint("%d of %d fetches failed, first with %s" % (len(failed), len(records), failed[0]), "red")
+    return times
+
 
-    # execute command!
-    wget_res = client.cmd('time (wget %s:8000/%s -o /tmp/wget%d -P /tmp/%d) 2> %s/wgettime%d ' % 
-            (serv_ip, args.target, run_num, run_num, args.dir, run_num))
+def parse_fcts(fetch_res):
+    "Flow completion times out of the client's output"
+    return fcts(parse_records(fetch_res))
 
-    # extract and return real time as reported by time
-    a = open(r"%s/wgettime%d" % (args.dir, run_num), "r")
-    for line in a:
-        if line.startswith("real"):
-            return float( re.findall("\d*\\.\d*", line)[0] ) 
 
-    # return nothing if nothing is found
-    return None
+def query_server_load(client, serv_ip, num_runs):
+    "Fetch the target num_runs times from each of args.concurrency fetchers at once"
+
+    # closed-loop unless an arrival rate is given, in which case the
+    # same total number of fetches arrive as a poisson process
+    fetch_res = client.cmd('python lib/TimedHTTPClient.py -n %d -s %f -c %d -r %f --settle --summary http://%s:8000/%s' %
+            (num_runs * args.concurrency, args.spacing, args.concurrency,
+             args.arrival_rate, serv_ip, args.target))
+
+    records = parse_records(fetch_res)
+    summary = ([r for r in records if r.get('summary')] or [{}])[-1]
+    times = fcts([r for r in records if not r.get('summary')])
+
+    return times, summary
 
 
 def start_server(net):
@@ -219,18 +292,43 @@ def start_server(net):
     server = net.getNodeByName('server')
     cprint("starting the server...", "green")
 
-    result = server.cmd('nohup python -m lib/SimpleVarLengthHTTPServer > %s/serverlog.txt &' % args.dir)
+    engine = args.engine or ('eventloop' if args.workload == 'load' else 'single')
+    result = server.cmd('nohup python -m lib/SimpleVarLengthHTTPServer 8000 --engine %s > %s/serverlog.txt &' %
+            (engine, args.dir))
+
+    # wait for the server to spin up
+    if not readiness.wait_listening(server, 8000):
+        cprint('SERVER NEVER STARTED LISTENING, EXITING NOW!!!', 'red')
+        net.stop()
+        sys.exit(1)
+
+def change_cwnd(server, serv_route, dst_ip, cwnd):
+    "Set the server's initial cwnd once its earlier connections are done"
 
-    # Have to sleep for a little to allow the server to spin up
-    # TODO - can we make this a little less hacky?
-    sleep(1)
+    if not readiness.wait_quiet(server, 8000):
+        cprint("%s still has open connections, going ahead anyway" % server.name, "red")
+
+    serv_res = server.cmd("ip route change %s initcwnd %d cwnd %d" % (serv_route, cwnd, cwnd))
+    server.cmd("ip route flush cache")
+
+    if not readiness.wait_route(server, dst_ip, cwnd):
+        cprint(">>>>>>> ROUTE TO %s DOESN'T CARRY INITCWND %d! <<<<<<<<<<" % (dst_ip, cwnd), "red")
+
+# the collector copying /proc/net/tcpprobe, while tcpprobe is running
+collector = None
 
 def start_tcpprobe():
+    global collector
     os.system("rmmod tcp_probe &>/dev/null; modprobe tcp_probe;")
-    Popen("cat /proc/net/tcpprobe > %s/tcp_probe.txt" % args.dir, shell=True)
+    collector = Collector(tcpprobe=dict(fname='%s/tcp_probe.txt' % args.dir))
+    collector.start()
 
 def stop_tcpprobe():
-    os.system("killall -9 cat; rmmod tcp_probe &>/dev/null;")
+    global collector
+    # returns once everything read is in tcp_probe.txt
+    collector.quit()
+    collector = None
+    os.system("rmmod tcp_probe &>/dev/null;")
 
 def increase_client_rwnd(net):
     """
@@ -254,15 +352,11 @@ def verify_cwnd(net, cwnd):
     server = net.getNodeByName('server')
     client = net.getNodeByName('client')
 
-    # Start tcpprobe, server, then client
+    # Start tcpprobe, then pull a 3 second long flow off the
+    # (already running) var length server
     start_tcpprobe()
     cprint("verifying the initial cwnd.... ", "green")
-    server.cmd("iperf -s -Z reno -p 5001 > /dev/null &")
-    iperf_res = client.cmd("iperf -c %s -Z reno -p 5001 -t 3 > /dev/null" % server.IP())
-    sleep(3)
-    
-    # stop iperf once client is done
-    os.system("killall -9 iperf")
+    client.cmd("wget -q -O /dev/null %s:8000/stream/3" % server.IP())
     stop_tcpprobe()
 
     # verify the initial cwnd
@@ -307,13 +401,10 @@ def run_simple_exp(net, num_runs):
     for cwnd in cwnds:
 
         #change congestion windows
-        sleep(0.5)
         print "testing for cwnd of size %d ...." % cwnd
 
         server.cmd("clear")
-        serv_res = server.cmd("ip route change %s initcwnd %d cwnd %d" % (serv_route, cwnd, cwnd))
-        #print "server results from ip route change ..... ", serv_res
-        server.cmd("ip route flush cache")
+        change_cwnd(server, serv_route, cli_ip, cwnd)
 
         # verify cwnds 
         #serv_v = server.cmd("ip route")
@@ -324,16 +415,24 @@ def run_simple_exp(net, num_runs):
         #print "client route = ", cli_r
         #verify_cwnd(net, cwnd) # TODO - doesn't really work
 
-        # test wget times
-        times = []
-        for r in range(num_runs):
-            cprint("%d ..." % (r + 1), "green")
-
-            times.append( query_server(client, serv_ip, r) )
-
-            sleep(0.5) # TODO - why are we getting those spurious times? this works fine
-
-        avg_time = sum(times)/len(times)
+        # test fetch times
+        if args.workload == 'load':
+            cprint("%d runs from each of %d fetchers ..." % (num_runs, args.concurrency), "green")
+            times, summary = query_server_load(client, serv_ip, num_runs)
+            print "fct percentiles -- p50 %.1f p90 %.1f p99 %.1f ms, %d errors" % \
+                (1000 * summary.get('p50', 0), 1000 * summary.get('p90', 0),
+                 1000 * summary.get('p99', 0), summary.get('errors', 0))
+        else:
+            cprint("%d runs ..." % num_runs, "green")
+            times = query_server_batch(client, serv_ip, num_runs)
+
+        # failed fetches are left out of the average
+        ok = [t for t in times if t is not None]
+        if not ok:
+            cprint('NO FETCH SUCCEEDED AT CWND %d, EXITING NOW!!!' % cwnd, 'red')
+            net.stop()
+            sys.exit(1)
+        avg_time = sum(ok)/len(ok)
         latency = int(avg_time * 1000)
         print times, " -- avg time -- ", avg_time, "ms"
         print " -- latency -- ", latency, "ms"
@@ -15,21 +15,393 @@ of ~42 packets (following the HTML protocol)
 
 __version__ = "0.6"
 
-__all__ = ["SimpleHTTPRequestHandler"]
+__all__ = ["SimpleHTTPRequestHandler", "ThreadingHTTPServer",
+           "PreforkHTTPServer", "EventLoopHTTPServer"]
 
 import os
+import sys
+import errno
+import select
+import signal
+import socket
+import argparse
 import posixpath
 import BaseHTTPServer
+import SocketServer
+import collections
 import urllib
+import urlparse
 import cgi
 import shutil
 import mimetypes
 import string
+import math
+import struct
+import time
+import json
+import threading
+import Queue
 try:
     from cStringIO import StringIO
 except ImportError:
     from StringIO import StringIO
 
+try:
+    import ctypes
+    import ctypes.util
+    _libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+except (ImportError, OSError):
+    _libc = None
+
+try:
+    _sendfile = os.sendfile
+except AttributeError:
+    # python 2 has no os.sendfile, so call sendfile(2) in libc directly
+    try:
+        _libc.sendfile.argtypes = [ctypes.c_int, ctypes.c_int,
+                                   ctypes.POINTER(ctypes.c_long),
+                                   ctypes.c_size_t]
+        _libc.sendfile.restype = ctypes.c_ssize_t
+
+        def _sendfile(out_fd, in_fd, offset, count):
+            off = ctypes.c_long(offset)
+            sent = _libc.sendfile(out_fd, in_fd, ctypes.byref(off), count)
+            if sent < 0:
+                err = ctypes.get_errno()
+                raise OSError(err, os.strerror(err))
+            return sent
+    except AttributeError:
+        _sendfile = None
+
+try:
+    monotonic = time.monotonic
+except AttributeError:
+    # python 2 has no monotonic clock either, use clock_gettime(2)
+    class _timespec(ctypes.Structure):
+        _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+    CLOCK_MONOTONIC = 1
+
+    def monotonic():
+        """Return the value of the monotonic clock in seconds."""
+        ts = _timespec()
+        if _libc.clock_gettime(CLOCK_MONOTONIC, ctypes.byref(ts)) != 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        return ts.tv_sec + ts.tv_nsec * 1e-9
+
+
+# struct tcp_info from <linux/tcp.h>: 8 u8 fields then 24 u32 fields
+TCP_INFO = getattr(socket, 'TCP_INFO', 11)
+_tcp_info = struct.Struct('8B24I')
+
+
+def tcp_info(sock):
+    """Return a dict of the interesting TCP_INFO fields of SOCK.
+
+    rtt and rttvar are in microseconds, snd_cwnd and snd_ssthresh in
+    segments.  Returns None if the kernel won't tell us.
+
+    """
+    try:
+        raw = sock.getsockopt(socket.IPPROTO_TCP, TCP_INFO, _tcp_info.size)
+    except (socket.error, AttributeError):
+        return None
+    if len(raw) < _tcp_info.size:
+        return None
+    info = _tcp_info.unpack(raw)
+    return {'state': info[0],
+            'ca_state': info[1],
+            'retransmits': info[2],
+            'rto': info[8],
+            'snd_mss': info[10],
+            'unacked': info[12],
+            'lost': info[14],
+            'retrans': info[15],
+            'rtt': info[23],
+            'rttvar': info[24],
+            'snd_ssthresh': info[25],
+            'snd_cwnd': info[26],
+            'total_retrans': info[31]}
+
+
+def _stamp(timing, event):
+    timing[event] = monotonic()
+
+
+class RecordWriter(object):
+
+    """Appends records to a JSON-lines file from a background thread.
+
+    Handlers only put records on a queue; the writer thread formats
+    them and writes whole lines in batches of up to `batch_bytes`, or
+    whatever it has after `flush_interval` seconds.  The file is opened
+    with O_APPEND and only ever written whole lines at a time, so the
+    prefork workers (each of which starts its own thread on first use)
+    can share it.
+
+    """
+
+    batch_bytes = 65536
+    flush_interval = 1.0
+
+    def __init__(self, fname):
+        self.fname = fname
+        self.pid = None
+        self.queue = None
+        self.thread = None
+
+    def write(self, record):
+        if self.pid != os.getpid():
+            self._start()
+        self.queue.put(record)
+
+    def close(self):
+        """Write out everything queued and stop the writer thread."""
+        if self.pid == os.getpid():
+            self.queue.put(None)
+            self.thread.join()
+            self.pid = None
+
+    def _start(self):
+        self.pid = os.getpid()
+        self.queue = Queue.Queue()
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _run(self):
+        fd = os.open(self.fname, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0644)
+        lines = []
+        size = 0
+        deadline = time.time() + self.flush_interval
+        try:
+            while True:
+                try:
+                    record = self.queue.get(
+                        timeout=max(0, deadline - time.time()))
+                except Queue.Empty:
+                    record = ()
+                if record:
+                    line = json.dumps(record) + '\n'
+                    lines.append(line)
+                    size += len(line)
+                if record is None or size >= self.batch_bytes or \
+                        time.time() >= deadline:
+                    if lines:
+                        os.write(fd, ''.join(lines))
+                        lines = []
+                        size = 0
+                    deadline = time.time() + self.flush_interval
+                if record is None:
+                    break
+        finally:
+            os.close(fd)
+
+
+# synthetic bodies are written as views of a cached block of at most
+# this many packets, so memory stays bounded for any requested size
+PAYLOAD_BLOCK_PACKETS = 64
+
+# (mss, packets) -> preallocated payload string
+_payload_cache = {}
+
+# (mss, packets) -> pre-rendered header lines for that synthetic object
+_synthetic_headers = {}
+
+# Last-Modified of every synthetic object
+SYNTHETIC_LAST_MODIFIED = "Sat, 02 Jun 2012 00:00:00 GMT"
+
+# chunked? -> header lines of a streamed synthetic body
+_STREAM_HEADERS = {
+    True: ("Content-type: text/html\r\n"
+           "Transfer-Encoding: chunked\r\n"
+           "Last-Modified: %s\r\n" % SYNTHETIC_LAST_MODIFIED),
+    False: ("Content-type: text/html\r\n"
+            "Last-Modified: %s\r\n" % SYNTHETIC_LAST_MODIFIED),
+}
+
+# (protocol, server version, code) -> status line and Server header
+_status_lines = {}
+
+# (second, "Date: ..." line) for the second it was rendered in
+_date_line = (0, '')
+
+
+def synthetic_payload(mss, size):
+    """Return the payload for SIZE packets of MSS bytes each.
+
+    Payloads are built once and then shared by every request in the
+    process, keyed by (mss, size).
+
+    """
+    key = (mss, size)
+    payload = _payload_cache.get(key)
+    if payload is None:
+        payload = string.zfill('endofpacket\n', mss) * size
+        _payload_cache[key] = payload
+    return payload
+
+
+def iter_stream(mss, seconds):
+    """Yield synthetic payload views until SECONDS seconds have passed.
+
+    The views all share one cached block, so memory use is the same
+    however long the stream runs.  The clock only starts on the first
+    view, and is checked as each one is taken.
+
+    """
+    view = memoryview(synthetic_payload(mss, PAYLOAD_BLOCK_PACKETS))
+    deadline = monotonic() + seconds
+    while monotonic() < deadline:
+        yield view
+
+
+def _chunked(chunks):
+    """Frame the pieces in CHUNKS with chunked transfer encoding."""
+    for chunk in chunks:
+        if len(chunk):
+            yield "%x\r\n" % len(chunk)
+            yield chunk
+            yield "\r\n"
+    yield "0\r\n\r\n"
+
+
+def _bursts(chunks, size):
+    """Regroup the memoryviews in CHUNKS into lists of SIZE bytes each."""
+    burst = []
+    room = size
+    for chunk in chunks:
+        while len(chunk):
+            piece = chunk[:room]
+            chunk = chunk[room:]
+            burst.append(piece)
+            room -= len(piece)
+            if not room:
+                yield burst
+                burst = []
+                room = size
+    if burst:
+        yield burst
+
+
+def synthetic_headers(mss, size):
+    """Return the header lines for a SIZE packet synthetic object."""
+    key = (mss, size)
+    headers = _synthetic_headers.get(key)
+    if headers is None:
+        headers = ("Content-type: text/html\r\n"
+                   "Content-Length: %d\r\n"
+                   "Last-Modified: %s\r\n"
+                   "Accept-Ranges: bytes\r\n" %
+                   (size * mss, SYNTHETIC_LAST_MODIFIED))
+        _synthetic_headers[key] = headers
+    return headers
+
+
+def iter_synthetic(mss, size, start=0, stop=None):
+    """Yield the body of a SIZE packet synthetic object as memoryviews.
+
+    Objects of up to PAYLOAD_BLOCK_PACKETS packets come out as a single
+    view; larger ones are repeated views of one cached block plus a
+    slice of it for the remainder.  START and STOP restrict the body
+    to that byte range, sliced out of the same cached block (the body
+    repeats every mss bytes, so any offset maps into the block).
+
+    """
+    if stop is None:
+        stop = size * mss
+    block = min(size, PAYLOAD_BLOCK_PACKETS)
+    if block <= 0:
+        return
+    view = memoryview(synthetic_payload(mss, block))
+    n = len(view)
+    pos = start
+    while pos < stop:
+        offset = pos % n
+        piece = view[offset:min(n, offset + stop - pos)]
+        yield piece
+        pos += len(piece)
+
+
+class _CacheEntry(object):
+
+    """A cached static file: its bytes plus the headers describing them."""
+
+    def __init__(self, path, mtime, ctype, last_modified, data):
+        self.path = path
+        self.mtime = mtime
+        self.ctype = ctype
+        self.last_modified = last_modified
+        self.headers = ("Content-type: %s\r\nContent-Length: %d\r\n"
+                        "Last-Modified: %s\r\nAccept-Ranges: bytes\r\n" %
+                        (ctype, len(data), last_modified))
+        self.data = data
+        self.checked = time.time()
+
+
+class FileCache(object):
+
+    """Size-bounded LRU cache of static file responses.
+
+    Entries are keyed by request path and remember the mtime of the
+    file they were read from.  A hit is served without touching the
+    file system unless the entry was last checked more than
+    `revalidate` seconds ago, in which case the file is stat'ed and
+    the entry dropped if its mtime changed.  Least recently used
+    entries are evicted to keep the cached bytes under `max_bytes`.
+
+    """
+
+    def __init__(self, max_bytes, revalidate=1.0):
+        self.max_bytes = max_bytes
+        self.revalidate = revalidate
+        self.entries = collections.OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """Return the fresh entry for KEY, or None on a miss."""
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None:
+                now = time.time()
+                if now - entry.checked > self.revalidate:
+                    try:
+                        mtime = os.stat(entry.path).st_mtime
+                    except OSError:
+                        mtime = None
+                    if mtime != entry.mtime:
+                        self.size -= len(entry.data)
+                        entry = None
+                    else:
+                        entry.checked = now
+            if entry is None:
+                self.misses += 1
+                return None
+            # re-insert at the most recently used end
+            self.entries[key] = entry
+            self.hits += 1
+            return entry
+
+    def put(self, key, entry):
+        """Cache ENTRY under KEY if it fits in the byte budget."""
+        if len(entry.data) > self.max_bytes:
+            return
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old.data)
+            self.entries[key] = entry
+            self.size += len(entry.data)
+            while self.size > self.max_bytes:
+                key, old = self.entries.popitem(last=False)
+                self.size -= len(old.data)
+                self.evictions += 1
+
 
 class SimpleHTTPRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
 
@@ -46,6 +418,113 @@ class SimpleHTTPRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
 
     server_version = "SimpleHTTP/" + __version__
 
+    # seconds an idle keep-alive connection is held open, None for ever
+    timeout = None
+
+    # maximum size of packet payload = 1448
+    # on mininet links w/ MSS = 1500
+    mss = 1448
+
+    # copy file bodies with sendfile(2) when the output is our socket
+    use_sendfile = True
+
+    # how many responses went out through each copy path
+    stats = {'sendfile': 0, 'buffered': 0, 'cache': 0, 'synthetic': 0,
+             'stream': 0}
+
+    # a FileCache to serve static files from memory, or None
+    file_cache = None
+
+    # log every request, set False to keep the log quiet under load
+    access_log = True
+
+    # write synthetic bodies in bursts of this many segments (0 = off)
+    # every pace_interval seconds, or at pace_rate bits/s if that is
+    # set, or else once per RTT of the connection
+    pace_segments = 0
+    pace_interval = None
+    pace_rate = None
+
+    # a RecordWriter taking a timing record for every request, or None
+    timing_log = None
+
+    # event -> monotonic time for the request being handled
+    timing = None
+
+    copy_path = None
+    status_code = None
+
+    # bytes of the file returned by send_head to copy, None for all
+    copy_length = None
+
+    def setup(self):
+        self.accepted = monotonic()
+        self.accepted_wall = time.time()
+        self.requests_served = 0
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+
+    def handle_one_request(self):
+        """Handle one request, recording its timing if asked to."""
+        self.copy_path = None
+        self.status_code = None
+        if self.timing_log is not None:
+            self.timing = {}
+        BaseHTTPServer.BaseHTTPRequestHandler.handle_one_request(self)
+        if self.timing and 'parsed' in self.timing:
+            self.timing['request'] = self.requests_served
+            self.mark('last_byte')
+            self.when_sent(self.write_timing, self.timing)
+            self.requests_served += 1
+        self.timing = None
+
+    def parse_request(self):
+        ok = BaseHTTPServer.BaseHTTPRequestHandler.parse_request(self)
+        if self.timing is not None:
+            self.timing['parsed'] = monotonic()
+        return ok
+
+    def send_response(self, code, message=None):
+        self.status_code = code
+        self.mark_first_byte()
+        BaseHTTPServer.BaseHTTPRequestHandler.send_response(self, code, message)
+
+    def mark(self, event):
+        """Time EVENT as the moment everything written so far is sent."""
+        if self.timing is not None:
+            self.when_sent(_stamp, self.timing, event)
+
+    def mark_first_byte(self):
+        if self.timing is not None and 'first_byte' not in self.timing:
+            self.timing['first_byte'] = None
+            self.mark('first_byte')
+
+    def when_sent(self, func, *args):
+        """Call FUNC(*ARGS) once everything written so far has been sent.
+
+        Writes are synchronous here so that is right away; the event
+        loop engine defers it until its output queue drains up to this
+        point.
+
+        """
+        func(*args)
+
+    def write_timing(self, timing):
+        """Hand the TIMING record of the finished request to timing_log."""
+        record = {'pid': os.getpid(),
+                  'client': '%s:%d' % self.client_address[:2],
+                  'request': timing['request'],
+                  'command': self.command,
+                  'path': self.path,
+                  'status': self.status_code,
+                  'copy_path': self.copy_path,
+                  'accepted_wall': self.accepted_wall,
+                  'accepted': self.accepted,
+                  'parsed': timing.get('parsed'),
+                  'first_byte': timing.get('first_byte'),
+                  'last_byte': timing.get('last_byte'),
+                  'tcp_info': tcp_info(self.connection)}
+        self.timing_log.write(record)
+
     def do_GET(self):
         """Serve a GET request."""
         f = self.send_head()
@@ -70,40 +549,66 @@ class SimpleHTTPRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
         None, in which case the caller has nothing further to do.
 
         """
-        path = self.translate_path(self.path)
+        self.copy_length = None
 
         # extract the path after the servers name
         fullpath = self.path[1:]
+        route, sep, query = fullpath.partition('?')
+        options = urlparse.parse_qs(query)
+
+        if route.startswith('stream/'):
+            # an unbounded flow that lasts the given number of seconds
+            try:
+                seconds = float(route[len('stream/'):])
+            except ValueError:
+                self.send_error(404, "File not found")
+                return None
+            return self.send_stream(iter_stream(self.mss, seconds))
 
-        if fullpath.isdigit():
+        if route.isdigit() and options.get('chunked') == ['1']:
+            return self.send_stream(iter_synthetic(self.mss, int(route)))
+
+        if route.isdigit():
             # send headers and then the number of packets specified in fullpath
-            # maximum size of packet payload = 1448 
-            # on mininet links w/ MSS = 1500
-            mss = 1448
-            size = int(fullpath)
-
-            self.send_response(200)
-            self.send_header("Content-type", "text/html")
-            self.send_header("Content-Length", str(size*mss))
-            self.send_header("Last-Modified", "Sat, 02 Jun 2012 00:00:00 GMT")
-            self.end_headers()
-            
-            # TODO - chunkify?
-            i = 0
-            tosend = string.zfill('endofpacket\n', mss)
-            while i < size:
-                self.wfile.write(tosend)
-                i = i+1
+            mss = self.mss
+            size = int(route)
+            length = size * mss
+            byte_range = self.parse_range(length, SYNTHETIC_LAST_MODIFIED)
+
+            # hold the head back so it shares segments with the body
+            self.set_cork(True)
+            if byte_range is None:
+                start, stop = 0, length
+                self.send_response_blob(synthetic_headers(mss, size))
+            else:
+                start, stop = byte_range
+                self.send_range_head(byte_range, length, "text/html",
+                                     SYNTHETIC_LAST_MODIFIED)
+
+            if self.command != 'HEAD' and start < stop:
+                chunks = iter_synthetic(mss, size, start, stop)
+                if self.pace_segments > 0:
+                    chunks = self.paced(chunks)
+                self.write_stream(chunks)
+                self.copy_path = 'synthetic'
+                self.stats['synthetic'] += 1
+            self.set_cork(False)
 
             return None
 
+        if self.file_cache is not None:
+            entry = self.file_cache.get(self.path)
+            if entry is not None:
+                return self.send_cached(entry)
 
+        path = self.translate_path(self.path)
         f = None
         if os.path.isdir(path):
             if not self.path.endswith('/'):
                 # redirect browser - doing basically what apache does
                 self.send_response(301)
                 self.send_header("Location", self.path + "/")
+                self.send_header("Content-Length", "0")
                 self.end_headers()
                 return None
             for index in "index.html", "index.htm":
@@ -122,14 +627,237 @@ class SimpleHTTPRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
         except IOError:
             self.send_error(404, "File not found")
             return None
+        fs = os.fstat(f.fileno())
+        last_modified = self.date_time_string(fs.st_mtime)
+        if self.file_cache is not None and fs[6] <= self.file_cache.max_bytes:
+            entry = _CacheEntry(path, fs.st_mtime, ctype, last_modified,
+                                f.read())
+            f.close()
+            self.file_cache.put(self.path, entry)
+            return self.send_cached(entry)
+        byte_range = self.parse_range(fs[6], last_modified)
+        if byte_range is not None:
+            if not self.send_range_head(byte_range, fs[6], ctype,
+                                        last_modified):
+                f.close()
+                return None
+            f.seek(byte_range[0])
+            self.copy_length = byte_range[1] - byte_range[0]
+            return f
         self.send_response(200)
         self.send_header("Content-type", ctype)
-        fs = os.fstat(f.fileno())
         self.send_header("Content-Length", str(fs[6]))
-        self.send_header("Last-Modified", self.date_time_string(fs.st_mtime))
+        self.send_header("Last-Modified", last_modified)
+        self.send_header("Accept-Ranges", "bytes")
         self.end_headers()
         return f
 
+    def parse_range(self, length, validator):
+        """Return the byte range the request asks for, as (start, stop).
+
+        LENGTH is the size of the whole entity and VALIDATOR its
+        Last-Modified date, which an If-Range header has to match.
+        Only a single range is supported: None means send the whole
+        entity (no usable Range header), and an empty range means the
+        request cannot be satisfied.
+
+        """
+        spec = self.headers.getheader('Range')
+        if spec is None:
+            return None
+        if_range = self.headers.getheader('If-Range')
+        if if_range is not None and if_range.strip() != validator:
+            return None
+        unit, sep, spec = spec.partition('=')
+        if unit.strip().lower() != 'bytes' or ',' in spec:
+            return None
+        first, sep, last = spec.strip().partition('-')
+        try:
+            if not first:
+                # suffix range, the last LAST bytes
+                start = max(0, length - int(last))
+                stop = length if int(last) > 0 else start
+            else:
+                start = int(first)
+                stop = int(last) + 1 if last else length
+        except ValueError:
+            return None
+        if not sep or start < 0 or stop <= start and first and last:
+            return None
+        if start >= length:
+            return (length, length)
+        return (start, min(stop, length))
+
+    def send_range_head(self, byte_range, length, ctype, last_modified):
+        """Send the head answering BYTE_RANGE of a LENGTH byte entity.
+
+        That is a 206 for a satisfiable range, returning True, or a 416
+        telling the client the entity length, returning False.
+
+        """
+        start, stop = byte_range
+        if start >= stop:
+            self.send_response_blob("Content-Range: bytes */%d\r\n"
+                                    "Content-Length: 0\r\n" % length, 416)
+            return False
+        self.send_response_blob("Content-type: %s\r\n"
+                                "Content-Length: %d\r\n"
+                                "Content-Range: bytes %d-%d/%d\r\n"
+                                "Last-Modified: %s\r\n"
+                                "Accept-Ranges: bytes\r\n" %
+                                (ctype, stop - start, start, stop - 1, length,
+                                 last_modified), 206)
+        return True
+
+    def send_stream(self, chunks):
+        """Send the pieces in CHUNKS as a body of unknown length.
+
+        HTTP/1.1 exchanges use chunked transfer encoding; otherwise the
+        end of the body is marked by closing the connection.  Pieces are
+        only taken from CHUNKS as they are sent.  Returns None like
+        send_head, the response is complete.
+
+        """
+        chunked = (self.protocol_version >= "HTTP/1.1" and
+                   self.request_version >= "HTTP/1.1")
+        self.set_cork(True)
+        self.send_response_blob(_STREAM_HEADERS[chunked])
+        if not chunked:
+            self.close_connection = 1
+        if self.command != 'HEAD':
+            if chunked:
+                chunks = _chunked(chunks)
+            if self.pace_segments > 0:
+                chunks = self.paced(chunks)
+            self.write_stream(chunks)
+            self.copy_path = 'stream'
+            self.stats['stream'] += 1
+        self.set_cork(False)
+        return None
+
+    def paced(self, chunks):
+        """Regroup the pieces in CHUNKS into paced bursts.
+
+        Each burst is pace_segments segments of mss bytes; bursts after
+        the first are preceded by a _Pause until their slot,
+        pace_interval (or the time pace_rate needs for a burst, or one
+        RTT) after the previous one.
+
+        """
+        burst = self.pace_segments * self.mss
+        if self.pace_rate:
+            interval = burst * 8.0 / self.pace_rate
+        elif self.pace_interval is not None:
+            interval = self.pace_interval
+        else:
+            info = tcp_info(self.connection)
+            interval = info['rtt'] / 1e6 if info else 0
+        start = monotonic()
+        for i, pieces in enumerate(_bursts(chunks, burst)):
+            if i and interval:
+                yield _Pause(start + i * interval)
+            for piece in pieces:
+                yield piece
+
+    def write_stream(self, items):
+        """Write ITEMS, body pieces and _Pause markers, to the client."""
+        for item in items:
+            if isinstance(item, _Pause):
+                self.pause_until(item.deadline)
+            else:
+                self.write_body(item)
+
+    def pause_until(self, deadline):
+        """Send nothing more until the monotonic clock reaches DEADLINE.
+
+        This blocks the handler, so pacing is only allowed on the event
+        loop engine, which queues the pause instead.
+
+        """
+        self.set_cork(False)
+        delay = deadline - monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        self.set_cork(True)
+
+    def send_cached(self, entry):
+        """Send a FileCache ENTRY, headers and (unless HEAD) body.
+
+        Returns None like send_head, the response is complete.
+
+        """
+        self.set_cork(True)
+        byte_range = self.parse_range(len(entry.data), entry.last_modified)
+        if byte_range is None:
+            data = entry.data
+            self.send_response_blob(entry.headers)
+        elif self.send_range_head(byte_range, len(entry.data), entry.ctype,
+                                  entry.last_modified):
+            data = memoryview(entry.data)[byte_range[0]:byte_range[1]]
+        else:
+            data = None
+        if self.command != 'HEAD' and data is not None:
+            self.write_body(data)
+            self.copy_path = 'cache'
+            self.stats['cache'] += 1
+        self.set_cork(False)
+        return None
+
+    def send_response_blob(self, headers, code=200):
+        """Send a CODE response head ending in the pre-rendered HEADERS.
+
+        This is send_response(code), a send_header() per header and
+        end_headers() in a single write: the status line is rendered
+        once per protocol and code and the Date header once a second.
+
+        """
+        global _date_line
+        self.status_code = code
+        self.mark_first_byte()
+        self.log_request(code)
+        if self.request_version == 'HTTP/0.9':
+            return
+        key = (self.protocol_version, self.server_version, code)
+        status = _status_lines.get(key)
+        if status is None:
+            status = "%s %d %s\r\nServer: %s\r\n" % (
+                self.protocol_version, code, self.responses[code][0],
+                self.version_string())
+            _status_lines[key] = status
+        now = int(time.time())
+        if _date_line[0] != now:
+            _date_line = (now, "Date: %s\r\n" % self.date_time_string(now))
+        self.write_body(status + _date_line[1] + headers + "\r\n")
+
+    def set_cork(self, on):
+        """Cork (or uncork) the connection with TCP_CORK.
+
+        While corked the kernel only sends full segments, so a head
+        written just before its body leaves in the same packets.
+
+        """
+        if hasattr(socket, 'TCP_CORK'):
+            try:
+                self.connection.setsockopt(socket.IPPROTO_TCP,
+                                           socket.TCP_CORK, int(on))
+            except (socket.error, AttributeError):
+                pass
+
+    def log_request(self, code='-', size='-'):
+        """Log an accepted request, unless access logging is off."""
+        if self.access_log:
+            BaseHTTPServer.BaseHTTPRequestHandler.log_request(self, code, size)
+
+    def write_body(self, data):
+        """Write DATA (a string or memoryview) straight to the client.
+
+        This bypasses wfile, whose write() would turn a memoryview
+        into a copy (or worse, its repr).
+
+        """
+        self.wfile.flush()
+        self.connection.sendall(data)
+
     def list_directory(self, path):
         """Helper to produce a directory listing (absent index.html).
 
@@ -206,8 +934,92 @@ class SimpleHTTPRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
         -- note however that this the default server uses this
         to copy binary data as well.
 
+        If sendfile is enabled, SOURCE is a real file and OUTPUTFILE
+        is the connected socket, the data is handed to the kernel with
+        sendfile(2) instead, so it never passes through user space.
+        The path taken is recorded in self.copy_path and counted in
+        self.stats.  Only self.copy_length bytes are copied when it is
+        set (for range requests).
+
+        """
+        count = self.copy_length
+        if self.use_sendfile and self.can_sendfile(source, outputfile):
+            self.sendfile(source, count)
+            self.copy_path = 'sendfile'
+        elif count is None:
+            shutil.copyfileobj(source, outputfile)
+            self.copy_path = 'buffered'
+        else:
+            while count > 0:
+                buf = source.read(min(count, 16*1024))
+                if not buf:
+                    break
+                outputfile.write(buf)
+                count -= len(buf)
+            self.copy_path = 'buffered'
+        self.stats[self.copy_path] += 1
+
+    def can_sendfile(self, source, outputfile):
+        """Return True if SOURCE can be sent to OUTPUTFILE with sendfile(2).
+
+        That requires sendfile support, an OUTPUTFILE that writes to
+        this handler's connected socket and a SOURCE backed by a real
+        file descriptor (directory listings are StringIOs).
+
+        """
+        if _sendfile is None or outputfile is not self.wfile:
+            return False
+        if not isinstance(self.connection, socket.socket):
+            return False
+        try:
+            source.fileno()
+        except (AttributeError, IOError, ValueError):
+            return False
+        return True
+
+    def sendfile(self, source, count=None):
+        """Send COUNT bytes of the file object SOURCE down the connection.
+
+        Copies from the current position of SOURCE, to its end if COUNT
+        is None, and leaves SOURCE positioned after what was sent.
+
+        """
+        out_fd = self.connection.fileno()
+        in_fd = source.fileno()
+        offset = source.tell()
+        remaining = os.fstat(in_fd).st_size - offset
+        if count is not None:
+            remaining = min(count, remaining)
+        # anything still sitting in wfile has to go out before the body
+        self.wfile.flush()
+        while remaining > 0:
+            try:
+                sent = _sendfile(out_fd, in_fd, offset, remaining)
+            except OSError, e:
+                if e.errno == errno.EINTR:
+                    continue
+                if e.errno == errno.EAGAIN:
+                    # the socket has a timeout and so is non-blocking
+                    self.wait_writable()
+                    continue
+                raise
+            if sent == 0:
+                break
+            offset += sent
+            remaining -= sent
+        source.seek(offset)
+
+    def wait_writable(self):
+        """Block until the connection can take more data.
+
+        Honours the socket timeout, raising socket.timeout when it
+        expires.
+
         """
-        shutil.copyfileobj(source, outputfile)
+        timeout = self.connection.gettimeout()
+        r, w, x = select.select([], [self.connection], [], timeout)
+        if not w:
+            raise socket.timeout('timed out')
 
     def guess_type(self, path):
         """Guess the type of a file.
@@ -244,9 +1056,582 @@ class SimpleHTTPRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
         })
 
 
+class ThreadingHTTPServer(SocketServer.ThreadingMixIn,
+                          BaseHTTPServer.HTTPServer):
+
+    """HTTP server that handles each connection in its own thread."""
+
+    daemon_threads = True
+
+
+class PreforkHTTPServer(BaseHTTPServer.HTTPServer):
+
+    """HTTP server backed by a fixed pool of forked worker processes.
+
+    The listen socket is bound once in the parent and every worker
+    accepts on it, so the kernel spreads connections across them.
+
+    """
+
+    workers = 4
+
+    def serve_forever(self, poll_interval=0.5):
+        # workers race for each connection, the losers must not block
+        # in accept()
+        self.socket.setblocking(0)
+        pids = []
+        for i in range(self.workers):
+            pid = os.fork()
+            if pid == 0:
+                try:
+                    BaseHTTPServer.HTTPServer.serve_forever(self, poll_interval)
+                except KeyboardInterrupt:
+                    pass
+                finally:
+                    print_stats(self.RequestHandlerClass)
+                    close_logs(self.RequestHandlerClass)
+                    os._exit(0)
+            pids.append(pid)
+
+        try:
+            for pid in pids:
+                os.waitpid(pid, 0)
+        finally:
+            for pid in pids:
+                try:
+                    os.kill(pid, signal.SIGTERM)
+                    os.waitpid(pid, 0)
+                except OSError:
+                    pass
+
+
+class _FileRegion(object):
+
+    """A byte range of an open file descriptor waiting to be sent."""
+
+    def __init__(self, fd, offset, count):
+        self.fd = fd
+        self.offset = offset
+        self.count = count
+
+
+class TimerWheel(object):
+
+    """Hashed timer wheel of `slots` buckets, each `tick` seconds wide.
+
+    Timers are filed in the bucket of the tick they expire in, so
+    scheduling is O(1) and advancing only looks at the buckets whose
+    ticks have passed.  Timers more than one revolution out share a
+    bucket with nearer ones and are simply skipped until their round.
+
+    """
+
+    def __init__(self, tick=0.001, slots=1024):
+        self.tick = tick
+        self.slots = [[] for i in range(slots)]
+        self.current = int(monotonic() / tick)
+        self.count = 0
+
+    def schedule(self, deadline, callback):
+        """Call CALLBACK() once the monotonic clock passes DEADLINE."""
+        t = max(int(math.ceil(deadline / self.tick)), self.current + 1)
+        self.slots[t % len(self.slots)].append((t, callback))
+        self.count += 1
+
+    def advance(self, now):
+        """Run the callbacks of every timer that expired by NOW."""
+        target = int(now / self.tick)
+        if target <= self.current:
+            return
+        n = len(self.slots)
+        if target - self.current >= n:
+            ticks = range(n)
+        else:
+            ticks = [t % n for t in xrange(self.current + 1, target + 1)]
+        self.current = target
+        for i in ticks:
+            slot = self.slots[i]
+            if not slot:
+                continue
+            due = [timer for timer in slot if timer[0] <= target]
+            if not due:
+                continue
+            slot[:] = [timer for timer in slot if timer[0] > target]
+            self.count -= len(due)
+            for t, callback in due:
+                callback()
+
+    def timeout(self, now):
+        """Seconds from NOW to the next bucket holding a timer, or None."""
+        if not self.count:
+            return None
+        n = len(self.slots)
+        for i in xrange(1, n + 1):
+            if self.slots[(self.current + i) % n]:
+                return max(0, (self.current + i) * self.tick - now)
+        return None
+
+
+class _Pause(object):
+
+    """Queue marker holding back the rest of a connection's output."""
+
+    def __init__(self, deadline):
+        self.deadline = deadline
+        self.scheduled = False
+
+
+class _Stream(object):
+
+    """Queue item producing body pieces lazily as the socket drains."""
+
+    def __init__(self, items):
+        self.items = iter(items)
+
+
+class _Connection(object):
+
+    """State the event loop keeps for one client connection."""
+
+    def __init__(self, sock, client_address):
+        self.sock = sock
+        self.client_address = client_address
+        self.accepted = monotonic()
+        self.accepted_wall = time.time()
+        self.requests_served = 0
+        self.last_active = time.time()
+        self.inbuf = ''
+        self.outq = collections.deque()
+        # close once everything queued has been sent
+        self.closing = False
+        # output is waiting on a _Pause
+        self.paused = False
+
+
+class _QueueFile(object):
+
+    """Stand-in for wfile that queues writes on a connection."""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def write(self, data):
+        if data:
+            self.conn.outq.append(data)
+
+    def flush(self):
+        pass
+
+
+class _EventLoopHandlerMixin:
+
+    """Runs a request handler against an already buffered request.
+
+    Instead of reading and writing a blocking socket, the handler gets
+    the request in an in-memory rfile and everything it writes is
+    queued on the connection for the event loop to send.
+
+    """
+
+    def __init__(self, request, client_address, server, rfile, conn):
+        self.request = self.connection = request
+        self.client_address = client_address
+        self.server = server
+        self.rfile = rfile
+        self.wfile = _QueueFile(conn)
+        self.conn = conn
+        self.accepted = conn.accepted
+        self.accepted_wall = conn.accepted_wall
+        self.requests_served = conn.requests_served
+
+    def write_body(self, data):
+        self.conn.outq.append(data)
+
+    def when_sent(self, func, *args):
+        self.conn.outq.append(lambda: func(*args))
+
+    def pause_until(self, deadline):
+        self.conn.outq.append(_Pause(deadline))
+
+    def write_stream(self, items):
+        self.conn.outq.append(_Stream(items))
+
+    def set_cork(self, on):
+        # the loop corks the socket while it drains the queue
+        pass
+
+    def sendfile(self, source, count=None):
+        fd = os.dup(source.fileno())
+        offset = source.tell()
+        if count is None:
+            count = os.fstat(fd).st_size - offset
+        self.conn.outq.append(_FileRegion(fd, offset, count))
+        source.seek(offset + count)
+
+
+def _event_loop_handler(HandlerClass):
+    class EventLoopHandler(_EventLoopHandlerMixin, HandlerClass):
+        pass
+    return EventLoopHandler
+
+
+class EventLoopHTTPServer(BaseHTTPServer.HTTPServer):
+
+    """Single threaded HTTP server multiplexing connections with poll().
+
+    Requests are read without blocking, handled as soon as their
+    headers are complete and the responses are drained as each socket
+    becomes writable, with file bodies going out through sendfile(2).
+    Persistent connections are closed once they have been idle for the
+    handler's timeout.  Paced responses park their connection on a
+    TimerWheel until the next burst is due.
+
+    """
+
+    # largest request head we are willing to buffer
+    max_request_size = 65536
+
+    def __init__(self, server_address, RequestHandlerClass,
+                 bind_and_activate=True):
+        BaseHTTPServer.HTTPServer.__init__(self, server_address,
+                                           RequestHandlerClass,
+                                           bind_and_activate)
+        self.EventLoopHandler = _event_loop_handler(RequestHandlerClass)
+        self.connections = {}
+        self.poller = None
+        self.wheel = TimerWheel()
+
+    def serve_forever(self, poll_interval=0.5):
+        self.socket.setblocking(0)
+        self.poller = select.poll()
+        self.poller.register(self.socket, select.POLLIN)
+        listen_fd = self.socket.fileno()
+        idle_timeout = self.RequestHandlerClass.timeout
+        if idle_timeout is not None:
+            poll_interval = min(poll_interval, idle_timeout)
+        try:
+            while True:
+                if idle_timeout is not None:
+                    self._close_idle(time.time() - idle_timeout)
+                now = monotonic()
+                self.wheel.advance(now)
+                timeout = self.wheel.timeout(now)
+                if timeout is None or timeout > poll_interval:
+                    timeout = poll_interval
+                try:
+                    events = self.poller.poll(timeout * 1000)
+                except select.error, e:
+                    if e.args[0] == errno.EINTR:
+                        continue
+                    raise
+                for fd, event in events:
+                    if fd == listen_fd:
+                        self._accept()
+                        continue
+                    conn = self.connections.get(fd)
+                    if conn is None:
+                        continue
+                    try:
+                        if event & (select.POLLIN | select.POLLHUP | select.POLLERR):
+                            self._read(conn)
+                        if event & select.POLLOUT or conn.outq:
+                            self._flush(conn)
+                    except socket.error:
+                        self._close(conn)
+                        continue
+                    self._update(conn)
+        finally:
+            for conn in self.connections.values():
+                self._close(conn)
+
+    def _accept(self):
+        while True:
+            try:
+                sock, client_address = self.socket.accept()
+            except socket.error, e:
+                if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                    return
+                raise
+            sock.setblocking(0)
+            conn = _Connection(sock, client_address)
+            self.connections[sock.fileno()] = conn
+            self.poller.register(sock, select.POLLIN)
+
+    def _read(self, conn):
+        try:
+            data = conn.sock.recv(65536)
+        except socket.error, e:
+            if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                return
+            raise
+        conn.last_active = time.time()
+        if not data:
+            # client is done sending, finish whatever we owe it
+            conn.closing = True
+            return
+        conn.inbuf += data
+        self._handle_requests(conn)
+
+    def _handle_requests(self, conn):
+        while not conn.closing:
+            end = conn.inbuf.find('\r\n\r\n')
+            if end < 0:
+                if len(conn.inbuf) > self.max_request_size:
+                    conn.closing = True
+                return
+            head = conn.inbuf[:end + 4]
+            conn.inbuf = conn.inbuf[end + 4:]
+
+            handler = self.EventLoopHandler(conn.sock, conn.client_address,
+                                            self, StringIO(head), conn)
+            handler.close_connection = 1
+            try:
+                handler.handle_one_request()
+            except Exception:
+                self.handle_error(conn.sock, conn.client_address)
+                handler.close_connection = 1
+            conn.requests_served = handler.requests_served
+            if handler.close_connection:
+                conn.closing = True
+
+    def _flush(self, conn):
+        if len(conn.outq) > 1:
+            # let queued heads and bodies share segments
+            self._set_cork(conn.sock, 1)
+            try:
+                self._drain(conn)
+            finally:
+                self._set_cork(conn.sock, 0)
+        else:
+            self._drain(conn)
+
+    def _set_cork(self, sock, on):
+        if hasattr(socket, 'TCP_CORK'):
+            try:
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_CORK, on)
+            except socket.error:
+                pass
+
+    def _drain(self, conn):
+        sock = conn.sock
+        while conn.outq:
+            item = conn.outq[0]
+            if callable(item):
+                conn.outq.popleft()
+                item()
+                continue
+            if isinstance(item, _Stream):
+                piece = next(item.items, None)
+                if piece is None:
+                    conn.outq.popleft()
+                else:
+                    conn.outq.appendleft(piece)
+                continue
+            if isinstance(item, _Pause):
+                if monotonic() < item.deadline:
+                    if not item.scheduled:
+                        item.scheduled = True
+                        self.wheel.schedule(item.deadline,
+                                            lambda: self._resume(conn))
+                    conn.paused = True
+                    return
+                conn.outq.popleft()
+                continue
+            try:
+                if isinstance(item, _FileRegion):
+                    sent = _sendfile(sock.fileno(), item.fd,
+                                     item.offset, item.count)
+                else:
+                    sent = sock.send(item)
+            except (socket.error, OSError), e:
+                if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                    return
+                raise
+
+            conn.last_active = time.time()
+            if isinstance(item, _FileRegion):
+                item.offset += sent
+                item.count -= sent
+                if item.count > 0 and sent > 0:
+                    continue
+                os.close(item.fd)
+            elif sent < len(item):
+                conn.outq[0] = memoryview(item)[sent:]
+                continue
+            conn.outq.popleft()
+
+    def _resume(self, conn):
+        if self.connections.get(conn.sock.fileno()) is not conn:
+            return
+        conn.paused = False
+        try:
+            self._flush(conn)
+        except socket.error:
+            self._close(conn)
+            return
+        self._update(conn)
+
+    def _update(self, conn):
+        if conn.closing and not conn.outq:
+            self._close(conn)
+        elif conn.outq and not conn.paused:
+            self.poller.modify(conn.sock, select.POLLIN | select.POLLOUT)
+        else:
+            self.poller.modify(conn.sock, select.POLLIN)
+
+    def _close_idle(self, deadline):
+        for conn in self.connections.values():
+            # a connection still sending, or parked between paced
+            # bursts, isn't idle however long ago it last moved
+            if conn.outq or conn.paused:
+                continue
+            if conn.last_active < deadline:
+                self._close(conn)
+
+    def _close(self, conn):
+        fd = conn.sock.fileno()
+        if self.connections.pop(fd, None) is None:
+            return
+        self.poller.unregister(fd)
+        for item in conn.outq:
+            if isinstance(item, _FileRegion):
+                os.close(item.fd)
+        conn.outq.clear()
+        self.shutdown_request(conn.sock)
+
+
+# --engine choices
+ENGINES = {
+    'single': BaseHTTPServer.HTTPServer,
+    'threaded': ThreadingHTTPServer,
+    'prefork': PreforkHTTPServer,
+    'eventloop': EventLoopHTTPServer,
+}
+
+
+def print_stats(HandlerClass = SimpleHTTPRequestHandler):
+    """Print the response counters of HandlerClass to stdout."""
+    print "Response stats:", " ".join("%s=%d" % item for item in
+                                      sorted(HandlerClass.stats.items()))
+    cache = HandlerClass.file_cache
+    if cache is not None:
+        print "File cache: hits=%d misses=%d evictions=%d bytes=%d" % (
+            cache.hits, cache.misses, cache.evictions, cache.size)
+    sys.stdout.flush()
+
+
+def close_logs(HandlerClass = SimpleHTTPRequestHandler):
+    """Flush and close the logs HandlerClass is writing."""
+    if HandlerClass.timing_log is not None:
+        HandlerClass.timing_log.close()
+
+
+def _interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+
 def test(HandlerClass = SimpleHTTPRequestHandler,
-         ServerClass = BaseHTTPServer.HTTPServer):
-    BaseHTTPServer.test(HandlerClass, ServerClass)
+         ServerClass = None):
+    parser = argparse.ArgumentParser(description="Simple var length HTTP server")
+    parser.add_argument('port',
+                        type=int,
+                        nargs='?',
+                        help="Port to listen on",
+                        default=8000)
+    parser.add_argument('--engine', '-e',
+                        choices=sorted(ENGINES),
+                        help="How to serve concurrent clients (default: single, "
+                             "or eventloop when pacing)",
+                        default=None)
+    parser.add_argument('--workers', '-w',
+                        type=int,
+                        help="Number of worker processes for the prefork engine",
+                        default=PreforkHTTPServer.workers)
+    parser.add_argument('--keepalive', '-k',
+                        action='store_true',
+                        help="Speak HTTP/1.1 with persistent, pipelined connections")
+    parser.add_argument('--idle-timeout',
+                        type=float,
+                        help="Seconds before an idle keep-alive connection is closed (0 = never)",
+                        default=5.0)
+    parser.add_argument('--cache-bytes',
+                        type=int,
+                        help="Keep up to this many bytes of static files in memory (0 = off)",
+                        default=0)
+    parser.add_argument('--cache-revalidate',
+                        type=float,
+                        help="Seconds between mtime checks of a cached file",
+                        default=1.0)
+    parser.add_argument('--no-access-log',
+                        dest='access_log',
+                        action='store_false',
+                        help="Don't log every request")
+    parser.add_argument('--pace-segments',
+                        type=int,
+                        help="Send synthetic bodies in bursts of this many segments "
+                             "(eventloop engine only)",
+                        default=0)
+    parser.add_argument('--pace-interval',
+                        type=float,
+                        help="Milliseconds between bursts (default: one RTT)",
+                        default=None)
+    parser.add_argument('--pace-rate',
+                        type=float,
+                        help="Pace bursts to this many Mb/s instead",
+                        default=None)
+    parser.add_argument('--timing-log',
+                        help="Append a JSON timing record for every request to this file",
+                        default=None)
+    parser.add_argument('--no-sendfile',
+                        dest='sendfile',
+                        action='store_false',
+                        help="Copy file bodies through user space instead of sendfile")
+    args = parser.parse_args()
+
+    # only the event loop waits out a pause without holding up other
+    # connections (or a thread per connection)
+    pacing = args.pace_segments > 0 or bool(args.pace_rate)
+    if args.engine is None:
+        args.engine = 'eventloop' if pacing else 'single'
+    elif pacing and args.engine != 'eventloop':
+        parser.error("pacing needs --engine eventloop, not %s" % args.engine)
+
+    if ServerClass is None:
+        ServerClass = ENGINES[args.engine]
+    PreforkHTTPServer.workers = args.workers
+
+    if args.keepalive:
+        HandlerClass.protocol_version = "HTTP/1.1"
+        HandlerClass.timeout = args.idle_timeout or None
+    HandlerClass.use_sendfile = args.sendfile
+    HandlerClass.access_log = args.access_log
+    if args.pace_rate and not args.pace_segments:
+        args.pace_segments = 1
+    HandlerClass.pace_segments = args.pace_segments
+    if args.pace_interval is not None:
+        HandlerClass.pace_interval = args.pace_interval / 1000.0
+    if args.pace_rate:
+        HandlerClass.pace_rate = args.pace_rate * 1e6
+    if args.timing_log:
+        HandlerClass.timing_log = RecordWriter(args.timing_log)
+    if args.cache_bytes > 0:
+        HandlerClass.file_cache = FileCache(args.cache_bytes,
+                                            args.cache_revalidate)
+    httpd = ServerClass(('', args.port), HandlerClass)
+
+    sa = httpd.socket.getsockname()
+    print "Serving HTTP on", sa[0], "port", sa[1], "..."
+    sys.stdout.flush()
+
+    # report the counters when we get torn down
+    signal.signal(signal.SIGTERM, _interrupt)
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print_stats(HandlerClass)
+        close_logs(HandlerClass)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,465 @@
+"""
+Timed HTTP Client.
+
+A minimal HTTP client meant to run inside a mininet host in place of
+`time wget ...`.  It times each fetch with a monotonic nanosecond
+clock from the moment it starts connecting, so no fork/exec or shell
+overhead ends up in the measured flow completion time, and prints one
+JSON record per fetch:
+
+    {"url": ..., "status": 200, "bytes": 42016, "start": <ns>,
+     "connect": <ns>, "first_byte": <ns>, "last_byte": <ns>,
+     "fct": <seconds>, "local_port": 40312}
+
+connect, first_byte and last_byte are offsets from start, which is an
+absolute reading of the monotonic clock.  local_port identifies the
+connection in tcp_probe or ss output.
+
+With --count the URLs are fetched over and over by the same process,
+--spacing seconds apart, so a whole batch of runs costs one process
+start and its results come back in a single read of stdout.
+
+With --concurrency K the fetches are spread over K fetcher threads
+sharing the process, to measure flow completion times under
+contention.  By default the load is closed-loop: each fetcher starts
+its next fetch as soon as (plus --spacing after) its last one ends.
+With --rate R it is open-loop instead: fetches arrive as a Poisson
+process of R per second regardless of how fast earlier ones finish,
+and are handed to the first idle fetcher; time an arrival spent
+waiting for one is reported as "queued" (ns) and not counted in its
+fct.  --duration bounds either kind of run in seconds, and --summary
+ends the output with a line of FCT percentiles:
+
+    {"summary": true, "fetches": 200, "errors": 0, "mean": <seconds>,
+     "p50": <seconds>, "p90": <seconds>, "p99": <seconds>}
+
+With --settle each fetcher waits, before its next fetch, for the
+connection of its last one to be closed or in TIME_WAIT, watching
+/proc/net/tcp, rather than for a fixed --spacing.
+
+"""
+
+
+__version__ = "0.1"
+
+__all__ = ["fetch", "clock_ns", "LoadGenerator", "summarize"]
+
+import os
+import sys
+import json
+import math
+import time
+import Queue
+import random
+import socket
+import argparse
+import urlparse
+import itertools
+import threading
+
+try:
+    clock_ns = time.perf_counter_ns
+except AttributeError:
+    # python 2 has no nanosecond clock, use clock_gettime(2) directly
+    import ctypes
+    import ctypes.util
+
+    class _timespec(ctypes.Structure):
+        _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+    _libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    CLOCK_MONOTONIC = 1
+
+    def clock_ns():
+        """Return the value of the monotonic clock in nanoseconds."""
+        ts = _timespec()
+        if _libc.clock_gettime(CLOCK_MONOTONIC, ctypes.byref(ts)) != 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        return ts.tv_sec * 1000000000 + ts.tv_nsec
+
+
+class _Response(object):
+
+    """Reads one HTTP response off a socket, noting when bytes arrive."""
+
+    def __init__(self, sock, head_only=False):
+        self.sock = sock
+        self.head_only = head_only
+        self.buf = ''
+        self.first_byte = None
+        self.status = None
+        self.headers = {}
+        self.bytes = 0
+        self.will_close = False
+
+    def _recv(self):
+        data = self.sock.recv(65536)
+        if data and self.first_byte is None:
+            self.first_byte = clock_ns()
+        return data
+
+    def _fill(self, want):
+        """Buffer WANT bytes, or a line if WANT is None; False at EOF."""
+        while True:
+            if want is None and '\n' in self.buf:
+                return True
+            if want is not None and len(self.buf) >= want:
+                return True
+            data = self._recv()
+            if not data:
+                return False
+            self.buf += data
+
+    def _line(self):
+        if not self._fill(None):
+            raise IOError("connection closed mid-response")
+        line, sep, self.buf = self.buf.partition('\n')
+        return line.rstrip('\r')
+
+    def read(self):
+        """Read the whole response, discarding the body."""
+        version, status, reason = (self._line().split(' ', 2) + [''])[:3]
+        self.status = int(status)
+        while True:
+            line = self._line()
+            if not line:
+                break
+            name, sep, value = line.partition(':')
+            self.headers[name.strip().lower()] = value.strip()
+
+        connection = self.headers.get('connection', '').lower()
+        self.will_close = (connection == 'close' or
+                           (version == 'HTTP/1.0' and connection != 'keep-alive'))
+        if self.head_only or self.status in (204, 304) or \
+                100 <= self.status < 200:
+            return
+        if self.headers.get('transfer-encoding', '').lower() == 'chunked':
+            self._read_chunked()
+        elif 'content-length' in self.headers:
+            self._read_length(int(self.headers['content-length']))
+        else:
+            self._read_length(None)
+            self.will_close = True
+
+    def _read_length(self, length):
+        # don't hold on to the body, just count it
+        while length is None or self.bytes < length:
+            if self.buf:
+                take = len(self.buf) if length is None else \
+                    min(len(self.buf), length - self.bytes)
+                self.bytes += take
+                self.buf = self.buf[take:]
+                continue
+            data = self._recv()
+            if not data:
+                if length is None:
+                    return
+                raise IOError("connection closed mid-body")
+            self.buf = data
+
+    def _read_chunked(self):
+        while True:
+            size = int(self._line().split(';', 1)[0], 16)
+            if size == 0:
+                break
+            self._read_length_chunk(size)
+            self._line()
+        # trailers
+        while self._line():
+            pass
+
+    def _read_length_chunk(self, size):
+        start = self.bytes
+        while self.bytes - start < size:
+            if not self.buf and not self._fill(1):
+                raise IOError("connection closed mid-chunk")
+            take = min(len(self.buf), size - (self.bytes - start))
+            self.bytes += take
+            self.buf = self.buf[take:]
+
+
+def fetch(url, sock=None, timeout=30.0, keepalive=False, method='GET'):
+    """Fetch URL and return (record, sock).
+
+    RECORD is the timing record described in the module docstring.
+    SOCK is an open connection to reuse, or None to connect; the
+    connection is returned for reuse when KEEPALIVE is set and the
+    server kept it open, otherwise it is closed and None returned.
+
+    """
+    parts = urlparse.urlsplit(url)
+    host = parts.hostname
+    port = parts.port or 80
+    path = parts.path or '/'
+    if parts.query:
+        path += '?' + parts.query
+
+    record = {'url': url}
+    start = clock_ns()
+    record['start'] = start
+    try:
+        if sock is None:
+            sock = socket.create_connection((host, port), timeout)
+        record['connect'] = clock_ns() - start
+        record['local_port'] = sock.getsockname()[1]
+        sock.sendall("%s %s HTTP/1.1\r\nHost: %s\r\nConnection: %s\r\n\r\n" %
+                     (method, path, parts.netloc,
+                      'keep-alive' if keepalive else 'close'))
+        response = _Response(sock, head_only=(method == 'HEAD'))
+        response.read()
+        last_byte = clock_ns()
+    except (socket.error, IOError, ValueError), e:
+        record['error'] = str(e)
+        if sock is not None:
+            sock.close()
+        return record, None
+
+    record['status'] = response.status
+    record['bytes'] = response.bytes
+    record['first_byte'] = response.first_byte - start
+    record['last_byte'] = last_byte - start
+    record['fct'] = (last_byte - start) / 1e9
+    if not keepalive or response.will_close:
+        sock.close()
+        sock = None
+    return record, sock
+
+
+# st column of /proc/net/tcp
+TCP_TIME_WAIT = 0x06
+TCP_CLOSE = 0x07
+
+
+def connection_closed(local_port, remote_port):
+    """Whether the connection between the two ports is closed, in
+    TIME_WAIT or gone altogether, going by /proc/net/tcp."""
+    for name in ('/proc/net/tcp', '/proc/net/tcp6'):
+        try:
+            f = open(name)
+        except IOError:
+            continue
+        with f:
+            f.readline()
+            for line in f:
+                fields = line.split()
+                if int(fields[1].rsplit(':', 1)[1], 16) != local_port or \
+                        int(fields[2].rsplit(':', 1)[1], 16) != remote_port:
+                    continue
+                if int(fields[3], 16) not in (TCP_TIME_WAIT, TCP_CLOSE):
+                    return False
+    return True
+
+
+def settle(local_port, remote_port, timeout=1.0, interval=0.001):
+    """Wait for the connection between the two ports to close, at
+    most TIMEOUT seconds; returns whether it did."""
+    deadline = clock_ns() + int(timeout * 1e9)
+    while not connection_closed(local_port, remote_port):
+        if clock_ns() >= deadline:
+            return False
+        time.sleep(interval)
+    return True
+
+
+def emit(record, out=sys.stdout):
+    """Write RECORD to OUT as one JSON line."""
+    out.write(json.dumps(record, sort_keys=True) + '\n')
+    out.flush()
+
+
+PERCENTILES = (50, 90, 99)
+
+
+def percentile(values, pct):
+    """Return the PCT-th percentile of sorted VALUES, by nearest rank."""
+    rank = int(math.ceil(pct / 100.0 * len(values)))
+    return values[max(rank, 1) - 1]
+
+
+def summarize(records):
+    """Return the summary record for a list of fetch RECORDS."""
+    fcts = sorted(r['fct'] for r in records if 'fct' in r)
+    summary = {'summary': True,
+               'fetches': len(records),
+               'errors': len(records) - len(fcts)}
+    if fcts:
+        summary['mean'] = sum(fcts) / len(fcts)
+        for pct in PERCENTILES:
+            summary['p%d' % pct] = percentile(fcts, pct)
+    return summary
+
+
+class LoadGenerator(object):
+
+    """Drives CONCURRENCY fetcher threads over a list of URLs.
+
+    The URLs are fetched in order COUNT times over (forever if COUNT
+    is 0, in which case DURATION has to bound the run).  RATE of 0
+    makes a closed-loop run, anything else an open-loop one with that
+    many Poisson arrivals per second; see the module docstring.
+    Records are emitted to OUT as fetches complete, and run() returns
+    them all.
+
+    """
+
+    def __init__(self, urls, count=1, concurrency=1, rate=0.0,
+                 duration=None, spacing=0.0, timeout=30.0,
+                 keepalive=False, settle=False, out=sys.stdout):
+        if not count and not duration:
+            raise ValueError("an unbounded count needs a duration")
+        self.urls = urls
+        self.count = count
+        self.concurrency = max(concurrency, 1)
+        self.rate = rate
+        self.duration = duration
+        self.spacing = spacing
+        self.timeout = timeout
+        self.keepalive = keepalive
+        self.settle = settle
+        self.out = out
+        self.records = []
+        self.lock = threading.Lock()
+        self.deadline = None
+        self.jobs = None
+
+    def expired(self):
+        return self.deadline is not None and clock_ns() >= self.deadline
+
+    def _urls(self):
+        rounds = itertools.count() if not self.count else xrange(self.count)
+        for i in rounds:
+            for url in self.urls:
+                if self.expired():
+                    return
+                yield url
+
+    def _next_job(self):
+        """Return the next (url, arrival) for a fetcher, None when done."""
+        if self.rate:
+            return self.jobs.get()
+        # closed loop: fetchers pull straight from the shared generator
+        with self.lock:
+            url = next(self.jobs, None)
+        if url is None:
+            return None
+        return url, None
+
+    def _done(self, record):
+        with self.lock:
+            self.records.append(record)
+            emit(record, self.out)
+
+    def _fetcher(self, ident):
+        sock = None
+        netloc = None
+        last = None
+        while True:
+            job = self._next_job()
+            if job is None:
+                break
+            url, arrival = job
+            if last is not None and sock is None and self.settle and \
+                    'local_port' in last:
+                settle(last['local_port'],
+                       urlparse.urlsplit(last['url']).port or 80)
+            if last is not None and self.spacing > 0 and not self.rate:
+                time.sleep(self.spacing)
+            if sock is not None and urlparse.urlsplit(url).netloc != netloc:
+                sock.close()
+                sock = None
+            netloc = urlparse.urlsplit(url).netloc
+            record, sock = fetch(url, sock, self.timeout, self.keepalive)
+            if self.concurrency > 1:
+                record['fetcher'] = ident
+            if arrival is not None:
+                record['queued'] = max(record['start'] - arrival, 0)
+            self._done(record)
+            last = record
+        if sock is not None:
+            sock.close()
+
+    def _arrivals(self):
+        """Feed the job queue with Poisson arrivals, then a stop per fetcher."""
+        due = clock_ns()
+        for url in self._urls():
+            due += int(random.expovariate(self.rate) * 1e9)
+            delay = (due - clock_ns()) / 1e9
+            if delay > 0:
+                time.sleep(delay)
+            if self.expired():
+                break
+            self.jobs.put((url, due))
+        for i in range(self.concurrency):
+            self.jobs.put(None)
+
+    def run(self):
+        if self.duration:
+            self.deadline = clock_ns() + int(self.duration * 1e9)
+        self.jobs = Queue.Queue() if self.rate else self._urls()
+        fetchers = [threading.Thread(target=self._fetcher, args=(i,))
+                    for i in range(self.concurrency)]
+        for t in fetchers:
+            t.daemon = True
+            t.start()
+        if self.rate:
+            self._arrivals()
+        for t in fetchers:
+            # join with a timeout so ^C still gets through
+            while t.is_alive():
+                t.join(1.0)
+        return self.records
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Timed HTTP client")
+    parser.add_argument('urls',
+                        nargs='+',
+                        help="URLs to fetch, in order")
+    parser.add_argument('--count', '-n',
+                        type=int,
+                        help="Fetch the URLs this many times",
+                        default=1)
+    parser.add_argument('--spacing', '-s',
+                        type=float,
+                        help="Seconds to wait between consecutive fetches",
+                        default=0.0)
+    parser.add_argument('--keepalive', '-k',
+                        action='store_true',
+                        help="Reuse one connection for consecutive fetches of a server")
+    parser.add_argument('--timeout',
+                        type=float,
+                        help="Socket timeout in seconds",
+                        default=30.0)
+    parser.add_argument('--concurrency', '-c',
+                        type=int,
+                        help="Number of concurrent fetchers",
+                        default=1)
+    parser.add_argument('--rate', '-r',
+                        type=float,
+                        help="Open-loop Poisson arrivals per second (0 for closed-loop)",
+                        default=0.0)
+    parser.add_argument('--duration', '-d',
+                        type=float,
+                        help="Stop starting fetches after this many seconds",
+                        default=None)
+    parser.add_argument('--settle',
+                        action='store_true',
+                        help="Wait for each fetch's connection to close before the next")
+    parser.add_argument('--summary',
+                        action='store_true',
+                        help="End with a line of FCT percentiles")
+    args = parser.parse_args()
+
+    if not args.count and not args.duration:
+        parser.error("--count 0 needs a --duration")
+    load = LoadGenerator(args.urls, args.count, args.concurrency, args.rate,
+                         args.duration, args.spacing, args.timeout,
+                         args.keepalive, args.settle)
+    records = load.run()
+    if args.summary:
+        emit(summarize(records))
+
+
+if __name__ == '__main__':
+    main()
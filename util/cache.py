@@ -0,0 +1,73 @@
+"Content-addressed store of measured samples, so only missing points get measured"
+
+import os
+import json
+import hashlib
+from time import time
+
+
+def file_digest(path):
+    "sha1 of a file's contents, so changed code invalidates what it measured"
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def kernel():
+    "The running kernel, as uname reports it"
+    (sysname, nodename, release, version, machine) = os.uname()
+    return '%s %s %s %s' % (sysname, release, version, machine)
+
+
+class ResultCache(object):
+    """Samples of measured jobs, kept in DIRECTORY under the sha1 of the
+       job and CONTEXT, everything else the samples depend on (kernel,
+       server and client configuration...).  Looks like a dict keyed
+       by job, so it can stand in for one."""
+
+    def __init__(self, directory, context):
+        self.directory = directory
+        self.context = context
+        self.memory = {}
+
+    def key(self, job):
+        "The address of JOB's samples in this context"
+        return hashlib.sha1(json.dumps({'job': json.loads(job),
+                                        'context': self.context},
+                                       sort_keys=True)).hexdigest()
+
+    def path(self, job):
+        key = self.key(job)
+        return os.path.join(self.directory, key[:2], key[2:] + '.json')
+
+    def __contains__(self, job):
+        return job in self.memory or os.path.exists(self.path(job))
+
+    def __getitem__(self, job):
+        if job not in self.memory:
+            try:
+                with open(self.path(job)) as f:
+                    self.memory[job] = json.load(f)['samples']
+            except IOError:
+                raise KeyError(job)
+        return self.memory[job]
+
+    def __setitem__(self, job, samples):
+        self.memory[job] = samples
+        path = self.path(job)
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+
+        # write it whole or not at all, so a crash can't leave a
+        # truncated entry behind
+        tmp = '%s.%d.tmp' % (path, os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump({'job': json.loads(job), 'context': self.context,
+                       'samples': samples, 'measured': time()},
+                      f, sort_keys=True)
+        os.rename(tmp, path)
+
+    def get(self, job, default=None):
+        try:
+            return self[job]
+        except KeyError:
+            return default
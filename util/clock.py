@@ -0,0 +1,68 @@
+"Monotonic time, and a sampling schedule on fixed deadlines"
+
+import os
+import time
+
+CLOCK_MONOTONIC = 1
+
+if hasattr(time, 'monotonic'):
+    monotonic = time.monotonic
+else:
+    # python 2 has no time.monotonic, call libc's clock_gettime
+    import ctypes
+    import ctypes.util
+
+    class _timespec(ctypes.Structure):
+        _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+    _libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    _libc.clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(_timespec)]
+    _ts = _timespec()
+
+    def monotonic():
+        "Seconds on a clock that never jumps, from an arbitrary start"
+        if _libc.clock_gettime(CLOCK_MONOTONIC, ctypes.byref(_ts)) != 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        return _ts.tv_sec + _ts.tv_nsec * 1e-9
+
+
+class DeadlineScheduler(object):
+    """Wakes up every interval_sec on deadlines counted from the start,
+       so time spent sampling doesn't push the later samples back.
+       Falling a whole interval or more behind skips the deadlines that
+       went by, counting them in missed, rather than sampling in a
+       burst to catch up."""
+
+    def __init__(self, interval_sec):
+        self.interval = interval_sec
+        self.last = monotonic()
+        self.deadline = self.last + interval_sec
+        self.ticks = 0
+        self.missed = 0
+
+    def remaining(self):
+        "Seconds until the next deadline, 0 once it's due"
+        return max(0.0, self.deadline - monotonic())
+
+    def tick(self):
+        """Take the current deadline as met; returns the seconds since
+           the last one was"""
+        now = monotonic()
+        elapsed = now - self.last
+        self.last = now
+        self.ticks += 1
+        self.deadline += self.interval
+        if now >= self.deadline:
+            behind = int((now - self.deadline) / self.interval) + 1
+            self.missed += behind
+            self.deadline += behind * self.interval
+        return elapsed
+
+    def wait(self):
+        """Sleep until the next deadline; returns the seconds since the
+           last one"""
+        delay = self.remaining()
+        if delay:
+            time.sleep(delay)
+        return self.tick()
@@ -0,0 +1,156 @@
+"One process sampling every monitor source, driven by commands over a pipe"
+
+import select
+from multiprocessing import Process, Pipe
+
+from util.clock import DeadlineScheduler
+from util.monitor import (QlenSource, CountSource, DevsSource, DevCountersSource,
+                          CpuSource, TcpProbeSource)
+
+# the kinds of source a collector can run, by name
+SOURCES = {
+    'qlen': QlenSource,
+    'count': CountSource,
+    'devs': DevsSource,
+    'dev_counters': DevCountersSource,
+    'cpu': CpuSource,
+    'tcpprobe': TcpProbeSource,
+}
+
+
+class CollectorError(Exception):
+    pass
+
+
+class Collector(object):
+    """A process that runs the sources it's given in a single select
+       loop, each periodic one on its own deadlines, and the others
+       whenever they're readable.  Each keyword names a kind of source
+       in SOURCES and gives the arguments to make it with, e.g.
+
+           Collector(qlen=dict(iface='s0-eth2', fname='qlen.txt'),
+                     tcpprobe=dict(fname='tcp_probe.txt'))
+
+       Nothing is sampled until start(); stop() closes a source's files
+       with everything it sampled written out, and start() opens them
+       afresh.  quit() stops whatever is running and ends the process."""
+
+    def __init__(self, **sources):
+        for name in sources:
+            if name not in SOURCES:
+                raise CollectorError('unknown source %s' % name)
+        self.sources = sources
+        self.conn, child = Pipe()
+        self.process = Process(target=_serve, args=(child, sources))
+        self.process.daemon = True
+        self.process.start()
+        child.close()
+
+    def command(self, *cmd):
+        self.conn.send(cmd)
+        (status, reply) = self.conn.recv()
+        if status == 'error':
+            raise CollectorError(reply)
+        return reply
+
+    def start(self, *names):
+        "Start sampling NAMES, or every source; returns the ones started"
+        return self.command('start', names)
+
+    def stop(self, *names):
+        """Stop sampling NAMES, or every source, once what they sampled
+           is written; returns {name: (deadlines met, deadlines missed)}"""
+        return self.command('stop', names)
+
+    def flush(self, *names):
+        "Write out what NAMES, or every source, sampled so far"
+        return self.command('flush', names)
+
+    def quit(self):
+        "Stop every source and end the collector"
+        if self.process.is_alive():
+            reply = self.command('quit', ())
+        else:
+            reply = {}
+        self.process.join()
+        self.conn.close()
+        return reply
+
+
+class _Running(object):
+    "A started source, and its schedule if it's periodic"
+
+    def __init__(self, source):
+        self.source = source
+        self.schedule = None
+        if source.interval_sec is not None:
+            self.schedule = DeadlineScheduler(source.interval_sec)
+
+
+def _serve(conn, sources):
+    running = {}
+
+    def stop(names):
+        stats = {}
+        for name in names or list(running):
+            if name in running:
+                r = running.pop(name)
+                r.source.close()
+                if r.schedule is not None:
+                    stats[name] = (r.schedule.ticks, r.schedule.missed)
+        return stats
+
+    def handle(cmd, names):
+        for name in names:
+            if name not in sources:
+                raise CollectorError('unknown source %s' % name)
+        if cmd == 'start':
+            started = []
+            for name in names or sorted(sources):
+                if name not in running:
+                    running[name] = _Running(SOURCES[name](**sources[name]))
+                    started.append(name)
+            return started
+        elif cmd in ('stop', 'quit'):
+            return stop(names)
+        elif cmd == 'flush':
+            for name in names or list(running):
+                if name in running:
+                    running[name].source.flush()
+            return None
+        raise CollectorError('unknown command %s' % cmd)
+
+    try:
+        while True:
+            periodic = [r for r in running.values() if r.schedule is not None]
+            readers = dict((r.source, name) for name, r in running.items()
+                           if r.schedule is None)
+            timeout = None
+            if periodic:
+                timeout = min(r.schedule.remaining() for r in periodic)
+
+            readable = select.select([conn] + list(readers), [], [], timeout)[0]
+
+            for source in readable:
+                # a source that has come to its end is done with
+                if source is not conn and not source.sample():
+                    stop([readers[source]])
+            for r in periodic:
+                if not r.schedule.remaining():
+                    r.source.sample(r.schedule.tick())
+
+            if conn in readable:
+                try:
+                    (cmd, names) = conn.recv()
+                except EOFError:
+                    # whoever started us is gone
+                    return
+                try:
+                    conn.send(('ok', handle(cmd, names)))
+                except Exception as e:
+                    conn.send(('error', '%s: %s' % (type(e).__name__, e)))
+                if cmd == 'quit':
+                    return
+    finally:
+        stop(())
+        conn.close()
@@ -0,0 +1,50 @@
+"Append-only journal of finished sweep jobs, so a sweep can resume after a crash"
+
+import os
+import json
+from time import time
+
+
+class Journal(object):
+    """One JSON line per finished job, each synced to disk before the
+       sweep goes on.  Opened with RESUME the jobs already in it that
+       were measured in the same CONTEXT are read back into entries,
+       otherwise it starts out empty."""
+
+    def __init__(self, path, resume=False, context=None):
+        self.path = path
+        self.context = context
+        self.entries = {}
+        if not os.path.exists(os.path.dirname(path) or '.'):
+            os.makedirs(os.path.dirname(path))
+
+        if resume and os.path.exists(path):
+            self.load()
+            self.f = open(path, 'a')
+        else:
+            self.f = open(path, 'w')
+
+    def load(self):
+        with open(self.path, 'r+') as f:
+            data = f.read()
+            # a crash mid-write leaves a torn last line; drop it so
+            # appending starts on a line of its own
+            end = data.rfind('\n') + 1
+            if end != len(data):
+                f.truncate(end)
+        for line in data[:end].splitlines():
+            record = json.loads(line)
+            if record.get('context') == self.context:
+                self.entries[record['job']] = record['samples']
+
+    def append(self, job, samples):
+        "Record that JOB finished with SAMPLES"
+        self.entries[job] = samples
+        self.f.write(json.dumps({'job': job, 'samples': samples,
+                                 'context': self.context, 'finished': time()},
+                                sort_keys=True) + '\n')
+        self.f.flush()
+        os.fsync(self.f.fileno())
+
+    def close(self):
+        self.f.close()
@@ -0,0 +1,118 @@
+"Reshaping a running network's TCLinks in place, and checking they took"
+
+import re
+
+from util.topo import link_config
+
+# ping's packets on the wire: 56 data + 8 icmp + 20 ip + 14 ethernet
+PING_BYTES = 98
+
+_UNITS = {'': 1, 'K': 1e3, 'M': 1e6, 'G': 1e9,
+          'us': 1e-3, 'ms': 1, 's': 1e3}
+
+
+class LinkConfigError(Exception):
+    "A link's tc configuration doesn't match what was asked for"
+    pass
+
+
+def link_intfs(net, node1='server', node2='s1'):
+    "Both interfaces of the (first) link between two nodes"
+    n1 = net.getNodeByName(node1)
+    n2 = net.getNodeByName(node2)
+    return list(n1.connectionsTo(n2)[0])
+
+
+def reconfigure(intfs, **params):
+    """Give every interface of INTFS the shape PARAMS (bw, delay, loss,
+       max_queue_size), replacing its whole tc configuration, so
+       anything left out is unshaped rather than kept"""
+    lconfig = link_config(**params)
+    for intf in intfs:
+        intf.config(**lconfig)
+
+
+def tc_settings(intf):
+    "Rate (Mb/s), delay (ms), loss (%) and queue limit tc reports for INTF"
+    shown = intf.cmd('tc qdisc show dev %s' % intf) + \
+            intf.cmd('tc class show dev %s' % intf)
+
+    settings = {}
+    m = re.search(r'\brate (\d+(?:\.\d+)?)([KMG]?)bit', shown)
+    if m:
+        settings['bw'] = float(m.group(1)) * _UNITS[m.group(2)] / 1e6
+    m = re.search(r'qdisc netem .*?\bdelay (\d+(?:\.\d+)?)(us|ms|s)\b', shown)
+    if m:
+        settings['delay'] = float(m.group(1)) * _UNITS[m.group(2)]
+    m = re.search(r'qdisc netem .*?\bloss (\d+(?:\.\d+)?)%', shown)
+    if m:
+        settings['loss'] = float(m.group(1))
+    m = re.search(r'qdisc netem .*?\blimit (\d+)', shown)
+    if m:
+        settings['max_queue_size'] = int(m.group(1))
+    return settings
+
+
+def delay_ms(delay):
+    "A mininet delay string such as '35ms' in milliseconds"
+    m = re.match(r'\s*(\d+(?:\.\d+)?)\s*(us|ms|s)?\s*$', str(delay))
+    if not m:
+        raise ValueError("bad delay %r" % (delay,))
+    return float(m.group(1)) * _UNITS[m.group(2) or 'us']
+
+
+def check_tc(intf, bw=None, delay=None, loss=None, max_queue_size=None,
+             tolerance=0.01):
+    "List how INTF's tc settings differ from the ones asked for"
+    settings = tc_settings(intf)
+    wanted = {}
+    if bw is not None:
+        wanted['bw'] = bw
+    if delay:
+        wanted['delay'] = delay_ms(delay)
+    if loss:
+        wanted['loss'] = loss
+    if max_queue_size is not None:
+        wanted['max_queue_size'] = max_queue_size
+
+    errors = []
+    for key, value in sorted(wanted.items()):
+        got = settings.get(key)
+        if got is None or abs(got - value) > tolerance * value:
+            errors.append('%s: %s is %s, wanted %s' % (intf, key, got, value))
+    return errors
+
+
+def ping_rtt(src, dst_ip, count=3):
+    "Smallest ping round trip time in ms from SRC to DST_IP, None if no replies"
+    rtts = [float(t) for t in
+            re.findall(r'time=(\d+(?:\.\d+)?) ms', src.cmd('ping -c %d -i 0.2 %s' % (count, dst_ip)))]
+    return min(rtts) if rtts else None
+
+
+def expected_rtt(bw=None, delay=None, **params):
+    """Ping time in ms over a link shaped on both of its ends:
+       the delay and a ping's serialization each way"""
+    rtt = 2 * delay_ms(delay) if delay else 0.0
+    if bw:
+        rtt += 2 * PING_BYTES * 8 / (bw * 1e3)
+    return rtt
+
+
+def verify(intfs, src, dst_ip, tolerance=0.1, slack_ms=2.0, **params):
+    """Check INTFS really carry PARAMS, by what tc reports and by
+       pinging DST_IP from SRC across them"""
+    errors = []
+    for intf in intfs:
+        errors += check_tc(intf, **params)
+
+    rtt = ping_rtt(src, dst_ip)
+    expected = expected_rtt(**params)
+    if rtt is None:
+        errors.append('no ping replies from %s' % dst_ip)
+    elif abs(rtt - expected) > tolerance * expected + slack_ms:
+        errors.append('ping rtt is %.1f ms, wanted %.1f ms' % (rtt, expected))
+
+    if errors:
+        raise LinkConfigError('; '.join(errors))
+    return rtt
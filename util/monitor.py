@@ -1,75 +1,310 @@
-from time import sleep, time
+from time import time
+import os
+import sys
+import errno
+import select
+import signal
+import threading
 from subprocess import *
-import re
+
+from util.netlink import QdiscStats
+from util.procnet import DevCounters, FIELDS
+from util.sink import SampleSink
+from util.clock import DeadlineScheduler
 
 default_dir = '.'
 
-def monitor_qlen(iface, interval_sec = 0.01, fname='%s/qlen.txt' % default_dir):
-    pat_queued = re.compile(r'backlog\s[^\s]+\s([\d]+)p')
-    cmd = "tc -s qdisc show dev %s" % (iface)
-    ret = []
-    open(fname, 'w').write('')
-    while 1:
-        p = Popen(cmd, shell=True, stdout=PIPE)
-        output = p.stdout.read()
-        # Not quite right, but will do for now
-        matches = pat_queued.findall(output)
-        if matches and len(matches) > 1:
-            ret.append(matches[1])
-            t = "%f" % time()
-            open(fname, 'a').write(t + ',' + matches[1] + '\n')
-        sleep(interval_sec)
-    #open('qlen.txt', 'w').write('\n'.join(ret))
-    return
+# Each source samples one thing into its file(s).  A periodic source has
+# an interval_sec and is sampled with the seconds since its last sample;
+# a source with interval_sec None has a fileno() instead, and is sampled
+# whenever that's readable.  The monitor_* functions run one source in a
+# loop of their own, util.collector runs any number of them in one process.
 
-def monitor_count(ipt_args="--src 10.0.0.0/8",
-                  interval_sec=0.01, fname='%s/bytes_sent.txt'
-                  % default_dir, chain="OUTPUT"):
-    cmd = "iptables -I %(chain)s 1 %(filter)s -j RETURN" % {
-        "filter": ipt_args,
-        "chain": chain,
-        }
-    # We always erase the first rule; will fix this later
-    Popen("iptables -D %s 1" % chain, shell=True).wait()
-    # Add our rule
-    Popen(cmd, shell=True).wait()
-    open(fname, 'w').write('')
-    cmd = "iptables -vnL %s 1 -Z" % (chain)
-    while 1:
-        p = Popen(cmd, shell=True, stdout=PIPE)
+class QlenSource(object):
+    "Queue length of @iface over rtnetlink, as \"time,qlen\" lines in @fname"
+
+    def __init__(self, iface, fname='%s/qlen.txt' % default_dir, interval_sec=0.01):
+        self.interval_sec = interval_sec
+        self.stats = QdiscStats(iface)
+        self.sink = SampleSink(fname, 'dL', '%f,%d\n')
+
+    def sample(self, elapsed):
+        qdiscs = self.stats.dump()
+        # Not quite right, but will do for now: like `tc -s qdisc`'s
+        # second backlog, the queue is the second qdisc (netem under htb)
+        if len(qdiscs) > 1:
+            self.sink.append(time(), qdiscs[1].get('qlen', 0))
+
+    def flush(self):
+        self.sink.flush(wait=True)
+
+    def close(self):
+        self.sink.close()
+        self.stats.close()
+
+class CountSource(object):
+    "Packets and bytes matching an iptables rule, as \"time,pkts,bytes\" lines in @fname"
+
+    def __init__(self, ipt_args="--src 10.0.0.0/8", fname='%s/bytes_sent.txt'
+                 % default_dir, chain="OUTPUT", interval_sec=0.01):
+        self.interval_sec = interval_sec
+        cmd = "iptables -I %(chain)s 1 %(filter)s -j RETURN" % {
+            "filter": ipt_args,
+            "chain": chain,
+            }
+        # We always erase the first rule; will fix this later
+        Popen("iptables -D %s 1" % chain, shell=True).wait()
+        # Add our rule
+        Popen(cmd, shell=True).wait()
+        # -x for exact counts, which the sink stores as numbers
+        self.cmd = "iptables -vnxL %s 1 -Z" % (chain)
+        self.sink = SampleSink(fname, 'ddd', '%f,%d,%d\n')
+
+    def sample(self, elapsed):
+        p = Popen(self.cmd, shell=True, stdout=PIPE)
         output = p.stdout.read().strip()
-        values = output.split(' ')
+        p.wait()
+        values = output.split()
         if len(values) > 2:
-            t = "%f" % time()
             pkts, bytes = values[0], values[1]
-            open(fname, 'a').write(','.join([t, pkts, bytes]) + '\n')
-        sleep(interval_sec)
-    return
+            self.sink.append(time(), int(pkts), int(bytes))
 
-def monitor_devs(dev_pattern='^s', fname="%s/bytes_sent.txt" %
+    def flush(self):
+        self.sink.flush(wait=True)
+
+    def close(self):
+        self.sink.close()
+
+class DevsSource(object):
+    """Total txed bytes and rate (in Mbps) of devices whose name matches
+       @dev_pattern, as "time,rate,bytes" lines in @fname"""
+
+    def __init__(self, dev_pattern='^s', fname="%s/bytes_sent.txt" %
+                 default_dir, interval_sec=0.01):
+        self.interval_sec = interval_sec
+        self.counters = DevCounters(dev_pattern)
+        self.prev = self.counters.sample()
+        self.sink = SampleSink(fname, 'ddd', '%f,%f,%d\n')
+
+    def sample(self, elapsed):
+        tx = FIELDS.index('tx_bytes')
+        cur = self.counters.sample()
+        t = time()
+        total = 0
+        # devices that came or went since the last sample don't count
+        for before, after in zip(self.prev, cur):
+            if before is not None and after is not None:
+                total += after[tx] - before[tx]
+        self.prev = cur
+        # the rate is over the time that really went by, which can be
+        # more than interval_sec if a deadline was missed
+        self.sink.append(t, total * 8 / elapsed / 1e6, total)
+
+    def flush(self):
+        self.sink.flush(wait=True)
+
+    def close(self):
+        self.sink.close()
+        self.counters.close()
+
+class DevCountersSource(object):
+    """rx/tx bytes, packets and drops of each device whose name matches
+       @dev_pattern, with the time of the sample, in the device's own
+       file (@fname % device) under a line naming the columns"""
+
+    line = '%f' + ',%d' * len(FIELDS) + '\n'
+    header = ','.join(('time',) + FIELDS) + '\n'
+
+    def __init__(self, dev_pattern='^s', fname="%s/dev_%%s.txt" %
                  default_dir, interval_sec=0.01):
+        self.interval_sec = interval_sec
+        self.fname = fname
+        self.counters = DevCounters(dev_pattern)
+        self.sinks = {}
+
+    def sample(self, elapsed):
+        values = self.counters.sample()
+        t = time()
+        for iface, row in zip(self.counters.ifaces, values):
+            if row is None:
+                continue
+            if iface not in self.sinks:
+                self.sinks[iface] = SampleSink(self.fname % iface, 'd' * (1 + len(FIELDS)),
+                                               self.line, header=self.header)
+            self.sinks[iface].append(t, *row)
+
+    def flush(self):
+        for sink in self.sinks.values():
+            sink.flush(wait=True)
+
+    def close(self):
+        for sink in self.sinks.values():
+            sink.close()
+        self.counters.close()
+
+# columns of a cpu line of /proc/stat, in the order top prints them
+CPU_FIELDS = ('user', 'system', 'nice', 'idle', 'iowait', 'irq', 'softirq', 'steal')
+_stat_columns = (1, 3, 2, 4, 5, 6, 7, 8)
+
+def _cpu_times():
+    "Per processor, the jiffies spent in each of CPU_FIELDS"
+    ret = []
+    for line in open('/proc/stat'):
+        if line.startswith('cpu') and line[3].isdigit():
+            fields = line.split() + ['0'] * 8
+            ret.append([int(fields[i]) for i in _stat_columns])
+    return ret
+
+class CpuSource(object):
+    """Per-processor utilization from /proc/stat, in @fname the way `top`
+       prints its Cpu lines, one line per processor, e.g.
+       Cpu0  :  0.0%us,  1.0%sy,  0.0%ni, 97.0%id,  0.0%wa,  0.0%hi,  2.0%si,  0.0%st"""
+
+    def __init__(self, fname="%s/cpu.txt" % default_dir, interval_sec=1.0):
+        self.interval_sec = interval_sec
+        self.sink = SampleSink(fname, 'Ldddddddd',
+                               'Cpu%d  : %4.1f%%us, %4.1f%%sy, %4.1f%%ni, %4.1f%%id, '
+                               '%4.1f%%wa, %4.1f%%hi, %4.1f%%si, %4.1f%%st\n')
+        self.prev = _cpu_times()
+
+    def sample(self, elapsed):
+        cur = _cpu_times()
+        for cpu, (before, after) in enumerate(zip(self.prev, cur)):
+            delta = [a - b for a, b in zip(after, before)]
+            total = float(sum(delta)) or 1.0
+            self.sink.append(cpu, *[100 * d / total for d in delta])
+        self.prev = cur
+
+    def flush(self):
+        self.sink.flush(wait=True)
+
+    def close(self):
+        self.sink.close()
+
+if hasattr(signal, 'pthread_kill'):
+    _pthread_kill = signal.pthread_kill
+else:
+    # python 2 can't signal a thread, call libc's pthread_kill
+    import ctypes
+    import ctypes.util
+    _libc = ctypes.CDLL(ctypes.util.find_library('pthread') or
+                        ctypes.util.find_library('c'))
+    _libc.pthread_kill.argtypes = [ctypes.c_ulong, ctypes.c_int]
+
+    def _pthread_kill(ident, signum):
+        _libc.pthread_kill(ident, signum)
+
+def _wake(signum, frame):
+    pass
+
+class TcpProbeSource(object):
+    """Copies /proc/net/tcpprobe to @fname as tcp_probe writes it.  That
+       file can't be polled and reading it blocks whatever the flags, so
+       a thread reads it into a pipe that can be; closing the source
+       interrupts the thread with SIGUSR1.  Has to be made in the main
+       thread, which handles the signal."""
+
+    interval_sec = None
+
+    def __init__(self, fname='%s/tcp_probe.txt' % default_dir, path='/proc/net/tcpprobe'):
+        if signal.getsignal(signal.SIGUSR1) in (signal.SIG_DFL, None):
+            signal.signal(signal.SIGUSR1, _wake)
+        self.fd = os.open(path, os.O_RDONLY)
+        self.out = open(fname, 'w')
+        self.rpipe, self.wpipe = os.pipe()
+        self.closing = False
+        self.reader = threading.Thread(target=self._read)
+        self.reader.daemon = True
+        self.reader.start()
+
+    def _read(self):
+        try:
+            while not self.closing:
+                try:
+                    data = os.read(self.fd, 65536)
+                except OSError as e:
+                    if e.errno == errno.EINTR:
+                        continue
+                    raise
+                if not data:
+                    break
+                while data:
+                    try:
+                        data = data[os.write(self.wpipe, data):]
+                    except OSError as e:
+                        if e.errno != errno.EINTR:
+                            raise
+        finally:
+            os.close(self.fd)
+            os.close(self.wpipe)
+
+    def fileno(self):
+        return self.rpipe
+
+    def sample(self, elapsed=None):
+        "Copy out what the reader has passed on; False at its end"
+        data = os.read(self.rpipe, 65536)
+        self.out.write(data)
+        return bool(data)
+
+    def flush(self):
+        self.out.flush()
+
+    def close(self):
+        self.closing = True
+        # keep draining the pipe, so the reader isn't stuck writing to it
+        while self.reader.is_alive():
+            _pthread_kill(self.reader.ident, signal.SIGUSR1)
+            if select.select([self.rpipe], [], [], 0.01)[0]:
+                self.sample()
+        while self.sample():
+            pass
+        os.close(self.rpipe)
+        self.out.close()
+
+def _report(name, schedule):
+    "Say how many sampling deadlines @name missed, if any"
+    if schedule.missed:
+        sys.stderr.write('%s missed %d of %d sampling deadlines\n' %
+                         (name, schedule.missed, schedule.ticks + schedule.missed))
+
+def _run(name, source, stop=None):
+    """Samples @source on its deadlines until @stop (an Event) is set or
+       the process is terminated, then writes out what it sampled"""
+    schedule = DeadlineScheduler(source.interval_sec)
+    try:
+        while stop is None or not stop.is_set():
+            source.sample(schedule.wait())
+    finally:
+        _report(name, schedule)
+        source.close()
+
+def monitor_qlen(iface, interval_sec = 0.01, fname='%s/qlen.txt' % default_dir,
+                 stop=None):
+    """Samples the queue length of @iface over rtnetlink every
+       @interval_sec (which can be well under a millisecond) and writes
+       "time,qlen" lines to @fname"""
+    _run('monitor_qlen', QlenSource(iface, fname, interval_sec), stop)
+
+def monitor_count(ipt_args="--src 10.0.0.0/8",
+                  interval_sec=0.01, fname='%s/bytes_sent.txt'
+                  % default_dir, chain="OUTPUT", stop=None):
+    _run('monitor_count', CountSource(ipt_args, fname, chain, interval_sec), stop)
+
+def monitor_devs(dev_pattern='^s', fname="%s/bytes_sent.txt" %
+                 default_dir, interval_sec=0.01, stop=None):
 
     """Aggregates (sums) all txed bytes and rate (in Mbps) from
        devices whose name matches @dev_pattern and writes to @fname"""
-    pat = re.compile(dev_pattern)
-    spaces = re.compile('\s+')
-    open(fname, 'w').write('')
-    prev_tx = {}
-    while 1:
-        lines = open('/proc/net/dev').read().split('\n')
-        t = str(time())
-        total = 0
-        for line in lines:
-            line = spaces.split(line.strip())
-            iface = line[0]
-            if pat.match(iface) and len(line) > 9:
-                tx_bytes = int(line[9])
-                total += tx_bytes - prev_tx.get(iface, tx_bytes)
-                prev_tx[iface] = tx_bytes
-        open(fname, 'a').write(','.join([t,
-             str(total * 8 / interval_sec / 1e6), str(total)]) + "\n")
-        sleep(interval_sec)
-    return
+    _run('monitor_devs', DevsSource(dev_pattern, fname, interval_sec), stop)
+
+def monitor_dev_counters(dev_pattern='^s', fname="%s/dev_%%s.txt" %
+                         default_dir, interval_sec=0.01, stop=None):
+    """Samples the rx/tx bytes, packets and drops of each device whose
+       name matches @dev_pattern and writes them, with the time of the
+       sample, to the device's own file (@fname % device), under a line
+       naming the columns"""
+    _run('monitor_dev_counters', DevCountersSource(dev_pattern, fname, interval_sec), stop)
 
 def monitor_devs_ng(fname="%s/txrate.txt" % default_dir, interval_sec=0.01):
     """Uses bwm-ng tool to collect iface tx rate stats.  Very reliable."""
@@ -78,11 +313,8 @@ def monitor_devs_ng(fname="%s/txrate.txt" % default_dir, interval_sec=0.01):
            (interval_sec * 1000, fname))
     Popen(cmd, shell=True).wait()
 
-def monitor_cpu(fname="%s/cpu.txt" % default_dir):
-    cmd = "(top -b -p 1 -d 1 | grep --line-buffered \"^Cpu\") > %s" % fname
-    # BL: Disabling until we reinstantiate attachment using setns.
-    #if container is not None:
-    #    cmd = ("(top -b -p 1 -d 1 | "
-    #           "grep --line-buffered \\\"^Cpu\\\") > %s" % fname)
-    #    cmd = "lxc-execute -n %s -- bash -c \"%s\"" % (container, cmd)
-    Popen(cmd, shell=True).wait()
+def monitor_cpu(fname="%s/cpu.txt" % default_dir, interval_sec=1.0, stop=None):
+    """Samples per-processor utilization from /proc/stat and writes it
+       the way `top` prints its Cpu lines, one line per processor, e.g.
+       Cpu0  :  0.0%us,  1.0%sy,  0.0%ni, 97.0%id,  0.0%wa,  0.0%hi,  2.0%si,  0.0%st"""
+    _run('monitor_cpu', CpuSource(fname, interval_sec), stop)
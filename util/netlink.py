@@ -0,0 +1,130 @@
+"Qdisc statistics over rtnetlink, without forking tc for every sample"
+
+import os
+import socket
+import struct
+
+NETLINK_ROUTE = 0
+
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+RTM_NEWQDISC = 36
+RTM_GETQDISC = 38
+
+NLM_F_REQUEST = 0x1
+NLM_F_DUMP = 0x300
+
+# rtattr types of a qdisc message
+TCA_KIND = 1
+TCA_STATS = 3
+TCA_STATS2 = 7
+
+# nested in TCA_STATS2
+TCA_STATS_BASIC = 1
+TCA_STATS_QUEUE = 3
+
+_nlmsghdr = struct.Struct('=IHHII')     # len, type, flags, seq, pid
+_tcmsg = struct.Struct('=BxxxiIII')     # family, ifindex, handle, parent, info
+_rtattr = struct.Struct('=HH')          # len, type
+_gnet_stats_basic = struct.Struct('=QI')        # bytes, packets
+_gnet_stats_queue = struct.Struct('=IIIII')     # qlen, backlog, drops, requeues, overlimits
+_tc_stats = struct.Struct('=QIIIIIII')  # bytes, packets, drops, overlimits, bps, pps, qlen, backlog
+
+
+def ifindex(iface):
+    "Interface index of IFACE, in the current network namespace"
+    with open('/sys/class/net/%s/ifindex' % iface) as f:
+        return int(f.read())
+
+
+def _align(n):
+    return (n + 3) & ~3
+
+
+def _attrs(buf, offset, end):
+    "(type, payload offset, payload end) of the rtattrs in BUF[offset:end]"
+    while offset + _rtattr.size <= end:
+        length, kind = _rtattr.unpack_from(buf, offset)
+        if length < _rtattr.size:
+            break
+        yield kind & 0x3fff, offset + _rtattr.size, offset + length
+        offset += _align(length)
+
+
+class QdiscStats(object):
+    """Reads the qdisc statistics of one interface from a single,
+       long-lived rtnetlink socket."""
+
+    def __init__(self, iface, bufsize=65536):
+        self.iface = iface
+        self.ifindex = ifindex(iface)
+        self.sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_ROUTE)
+        self.sock.bind((0, 0))
+        self.buf = bytearray(bufsize)
+        self.seq = 0
+
+    def request(self):
+        self.seq += 1
+        tcm = _tcmsg.pack(socket.AF_UNSPEC, 0, 0, 0, 0)
+        return _nlmsghdr.pack(_nlmsghdr.size + len(tcm), RTM_GETQDISC,
+                              NLM_F_REQUEST | NLM_F_DUMP, self.seq, 0) + tcm
+
+    def dump(self):
+        """The interface's qdiscs in the order tc lists them, each a dict
+           of handle, parent, kind, qlen, backlog, drops, requeues,
+           overlimits, bytes and packets"""
+        self.sock.send(self.request())
+        qdiscs = []
+        while True:
+            n = self.sock.recv_into(self.buf)
+            offset = 0
+            while offset + _nlmsghdr.size <= n:
+                length, kind, flags, seq, pid = _nlmsghdr.unpack_from(self.buf, offset)
+                if length < _nlmsghdr.size:
+                    return qdiscs
+                # skip anything left over from an earlier request
+                if seq == self.seq:
+                    if kind == NLMSG_DONE:
+                        return qdiscs
+                    elif kind == NLMSG_ERROR:
+                        err = -struct.unpack_from('=i', self.buf, offset + _nlmsghdr.size)[0]
+                        raise OSError(err, os.strerror(err))
+                    elif kind == RTM_NEWQDISC:
+                        qdisc = self._parse(offset + _nlmsghdr.size, offset + length)
+                        if qdisc is not None:
+                            qdiscs.append(qdisc)
+                offset += _align(length)
+
+    def _parse(self, offset, end):
+        buf = self.buf
+        family, index, handle, parent, info = _tcmsg.unpack_from(buf, offset)
+        # a dump covers every interface, keep only ours
+        if index != self.ifindex:
+            return None
+
+        qdisc = {'handle': handle, 'parent': parent, 'kind': None}
+        stats = None
+        for kind, start, stop in _attrs(buf, offset + _tcmsg.size, end):
+            if kind == TCA_KIND:
+                qdisc['kind'] = str(buf[start:stop]).rstrip('\0')
+            elif kind == TCA_STATS2:
+                for skind, sstart, sstop in _attrs(buf, start, stop):
+                    if skind == TCA_STATS_BASIC:
+                        qdisc['bytes'], qdisc['packets'] = \
+                            _gnet_stats_basic.unpack_from(buf, sstart)
+                    elif skind == TCA_STATS_QUEUE:
+                        (qdisc['qlen'], qdisc['backlog'], qdisc['drops'],
+                         qdisc['requeues'], qdisc['overlimits']) = \
+                            _gnet_stats_queue.unpack_from(buf, sstart)
+            elif kind == TCA_STATS and stop - start >= _tc_stats.size:
+                stats = _tc_stats.unpack_from(buf, start)
+
+        # kernels without TCA_STATS2 only have the old struct tc_stats
+        if 'qlen' not in qdisc and stats is not None:
+            (qdisc['bytes'], qdisc['packets'], qdisc['drops'],
+             qdisc['overlimits'], bps, pps, qdisc['qlen'],
+             qdisc['backlog']) = stats
+        return qdisc
+
+    def close(self):
+        self.sock.close()
@@ -0,0 +1,74 @@
+"Running independent sweep points side by side, and watching their CPU"
+
+import threading
+import Queue
+from time import time
+
+from mininet.util import numCores
+
+# a host that used more than this much of its CPU allowance was starved
+STARVED = 0.9
+
+
+def cpu_usage(host):
+    "Seconds of CPU a CPULimitedHost's cgroup has used so far"
+    return int(host.cgroupGet('usage', resource='cpuacct')) / 1e9
+
+
+class CPUWatch(object):
+    "CPU used by a few CPULimitedHosts over one run, against their allowance"
+
+    def __init__(self, hosts, cpu):
+        """hosts: CPULimitedHosts to watch
+           cpu: system fraction each of them was given"""
+        self.hosts = hosts
+        self.allowed = cpu * numCores()  # in cores
+        self.start()
+
+    def start(self):
+        self.began = time()
+        self.usage = [cpu_usage(host) for host in self.hosts]
+
+    def stop(self):
+        """Per host name, the cores it used on average and the headroom
+           it had left, as a fraction of its allowance"""
+        elapsed = max(time() - self.began, 1e-6)
+        report = {}
+        for host, before in zip(self.hosts, self.usage):
+            used = (cpu_usage(host) - before) / elapsed
+            report[host.name] = {'cores': used,
+                                 'headroom': 1 - used / self.allowed,
+                                 'starved': used > STARVED * self.allowed}
+        return report
+
+
+def run_parallel(slots, jobs, work):
+    """Call WORK(slot, job) for every job in JOBS, with one thread per
+       slot in SLOTS taking the next job as soon as its slot is free.
+       Returns the results in job order; a job that raised has the
+       exception as its result."""
+    queue = Queue.Queue()
+    for i, job in enumerate(jobs):
+        queue.put((i, job))
+    results = [None] * len(jobs)
+
+    def worker(slot):
+        while True:
+            try:
+                i, job = queue.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                results[i] = work(slot, job)
+            except Exception, e:
+                results[i] = e
+
+    threads = [threading.Thread(target=worker, args=(slot,)) for slot in slots]
+    for t in threads:
+        t.daemon = True
+        t.start()
+    for t in threads:
+        # join with a timeout so ^C still gets through
+        while t.is_alive():
+            t.join(1.0)
+    return results
@@ -0,0 +1,96 @@
+"Interface counters from one open /proc/net/dev, re-read with pread(2)"
+
+import os
+import re
+
+if not hasattr(os, 'pread'):
+    # python 2 has no os.pread, call libc's
+    import ctypes
+    import ctypes.util
+    _libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    _libc.pread.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_size_t, ctypes.c_long]
+    _libc.pread.restype = ctypes.c_ssize_t
+
+
+# counters kept per interface, and their columns in /proc/net/dev
+# (after the interface name: 8 rx counters, then 8 tx counters)
+FIELDS = ('rx_bytes', 'rx_packets', 'rx_drop', 'tx_bytes', 'tx_packets', 'tx_drop')
+_columns = (0, 1, 3, 8, 9, 11)
+
+
+class DevCounters(object):
+    """FIELDS counters of the interfaces matching a pattern, read from
+       a /proc/net/dev that stays open.  The row of each interface is
+       worked out once and looked up again only when the file changes
+       shape, which is also when interfaces that came up since are
+       picked up."""
+
+    def __init__(self, dev_pattern='^s', path='/proc/net/dev', bufsize=65536):
+        self.fd = os.open(path, os.O_RDONLY)
+        self.pat = re.compile(dev_pattern)
+        self._resize(bufsize)
+        self.ifaces = []
+        self.index = []
+        self.nlines = None
+
+    def _resize(self, bufsize):
+        self.bufsize = bufsize
+        if not hasattr(os, 'pread'):
+            self.buf = ctypes.create_string_buffer(bufsize)
+
+    def _pread(self):
+        if hasattr(os, 'pread'):
+            return os.pread(self.fd, self.bufsize, 0)
+        n = _libc.pread(self.fd, self.buf, self.bufsize, 0)
+        if n < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        return self.buf.raw[:n]
+
+    def read(self):
+        "The whole file, in one pread"
+        while True:
+            data = self._pread()
+            if len(data) < self.bufsize:
+                return data
+            self._resize(self.bufsize * 2)
+
+    def _reindex(self, lines):
+        "Find every interface's row again, adding new matching ones"
+        rows = {}
+        for i, line in enumerate(lines):
+            name, sep, counters = line.partition(':')
+            if sep and i >= 2:
+                rows[name.strip()] = i
+        self.ifaces.extend(sorted(name for name in rows
+                                  if self.pat.match(name) and name not in self.ifaces))
+        self.index = [rows.get(name) for name in self.ifaces]
+        self.nlines = len(lines)
+
+    def _valid(self, lines):
+        "Whether the interfaces are still on the rows indexed"
+        if len(lines) != self.nlines:
+            return False
+        for name, row in zip(self.ifaces, self.index):
+            if row is not None and lines[row].partition(':')[0].strip() != name:
+                return False
+        return True
+
+    def sample(self):
+        """The FIELDS counters of each interface, in the order of
+           ifaces, or None for an interface that's gone"""
+        lines = self.read().split('\n')
+        if not self._valid(lines):
+            self._reindex(lines)
+
+        values = []
+        for row in self.index:
+            if row is None:
+                values.append(None)
+            else:
+                counters = lines[row].partition(':')[2].split()
+                values.append([int(counters[i]) for i in _columns])
+        return values
+
+    def close(self):
+        os.close(self.fd)
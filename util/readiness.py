@@ -0,0 +1,82 @@
+"Readiness probes, so experiments wait on events instead of fixed sleeps"
+
+import re
+from time import sleep, time
+
+# st column of /proc/net/tcp
+TCP_STATES = {0x01: 'ESTABLISHED', 0x02: 'SYN_SENT', 0x03: 'SYN_RECV',
+              0x04: 'FIN_WAIT1', 0x05: 'FIN_WAIT2', 0x06: 'TIME_WAIT',
+              0x07: 'CLOSE', 0x08: 'CLOSE_WAIT', 0x09: 'LAST_ACK',
+              0x0A: 'LISTEN', 0x0B: 'CLOSING'}
+
+# states a connection that is done sending can be left in
+CLOSED_STATES = ('TIME_WAIT', 'CLOSE')
+
+
+def poll(check, timeout, interval=0.005):
+    """Call CHECK until it returns something true or TIMEOUT seconds
+       have passed, and return its last result"""
+    deadline = time() + timeout
+    while True:
+        result = check()
+        if result or time() >= deadline:
+            return result
+        sleep(interval)
+
+
+def parse_proc_net_tcp(text):
+    "(local port, remote port, state) of every socket listed in /proc/net/tcp TEXT"
+    sockets = []
+    for line in text.split('\n'):
+        fields = line.split()
+        if len(fields) < 4 or not fields[0].endswith(':'):
+            continue
+        local = int(fields[1].rsplit(':', 1)[1], 16)
+        remote = int(fields[2].rsplit(':', 1)[1], 16)
+        state = int(fields[3], 16)
+        sockets.append((local, remote, TCP_STATES.get(state, state)))
+    return sockets
+
+
+def tcp_sockets(node):
+    "TCP sockets of NODE's network namespace"
+    return parse_proc_net_tcp(node.cmd('cat /proc/net/tcp /proc/net/tcp6 2>/dev/null'))
+
+
+def listening(node, port):
+    "Whether something on NODE listens on PORT"
+    return any(local == port and state == 'LISTEN'
+               for local, remote, state in tcp_sockets(node))
+
+
+def quiet(node, port):
+    "Whether every connection to PORT on NODE is closed, in TIME_WAIT or gone"
+    return all(state in CLOSED_STATES
+               for local, remote, state in tcp_sockets(node)
+               if local == port and state != 'LISTEN')
+
+
+def route_cwnd(node, dst_ip):
+    "initcwnd of the route NODE takes to DST_IP, None if it has none"
+    # older iproute2 doesn't print metrics for `ip route get`, so
+    # fall back to the routes covering the destination
+    for cmd in ('ip route get %s', 'ip route show match %s'):
+        m = re.search(r'\binitcwnd (\d+)', node.cmd(cmd % dst_ip))
+        if m:
+            return int(m.group(1))
+    return None
+
+
+def wait_listening(node, port=8000, timeout=10.0):
+    "Wait for a server on NODE to listen on PORT; False on timeout"
+    return poll(lambda: listening(node, port), timeout)
+
+
+def wait_quiet(node, port=8000, timeout=5.0):
+    "Wait for NODE's earlier connections to PORT to finish; False on timeout"
+    return poll(lambda: quiet(node, port), timeout)
+
+
+def wait_route(node, dst_ip, cwnd, timeout=1.0):
+    "Wait for NODE's route to DST_IP to carry initcwnd CWND; False on timeout"
+    return poll(lambda: route_cwnd(node, dst_ip) == cwnd, timeout)
@@ -0,0 +1,130 @@
+"Buffered sample sinks, so monitors don't pay for a write per sample"
+
+import atexit
+import signal
+import threading
+import Queue
+from array import array
+from time import time
+
+_open_sinks = set()
+_handlers_installed = False
+
+
+def _close_all():
+    for sink in list(_open_sinks):
+        sink.close()
+
+
+def _on_sigterm(signum, frame):
+    # unwind the sampling loop so its finally clauses close the sinks
+    raise SystemExit(0)
+
+
+def _install_handlers():
+    """Flush the sinks when the process exits, and when it's asked to
+       stop with SIGTERM, the way monitor processes get stopped"""
+    global _handlers_installed
+    if _handlers_installed:
+        return
+    _handlers_installed = True
+    atexit.register(_close_all)
+    try:
+        if signal.getsignal(signal.SIGTERM) == signal.SIG_DFL:
+            signal.signal(signal.SIGTERM, _on_sigterm)
+    except ValueError:
+        # not the main thread; atexit has to do
+        pass
+
+
+class SampleSink(object):
+    """Rows of samples, kept in preallocated array columns and written
+       to a file as text lines by a background thread.
+
+       typecodes: array typecode of each column, e.g. 'dL'
+       line: format of one row's line, e.g. '%f,%d\\n'
+       batch: rows per buffer; a full buffer is handed to the writer
+       flush_sec: hand over a partly filled buffer after this long
+       header: written once, before the first row, if given
+
+       append() only ever stores into a buffer; when one fills up the
+       writer gets it and sampling goes on in a spare one (a new one,
+       if the writer still holds them all), so it never waits on disk.
+       Whatever is left is written by close(), which runs at exit and
+       on SIGTERM too."""
+
+    def __init__(self, fname, typecodes, line, batch=4096, flush_sec=1.0,
+                 header=None):
+        self.fname = fname
+        self.typecodes = typecodes
+        self.line = line
+        self.batch = batch
+        self.flush_sec = flush_sec
+
+        self.out = open(fname, 'w')
+        if header is not None:
+            self.out.write(header)
+        self.full = Queue.Queue()
+        self.spare = Queue.Queue()
+        self.columns = self._buffer()
+        self.n = 0
+        self.flushed = time()
+        self.closed = False
+
+        self.writer = threading.Thread(target=self._write)
+        self.writer.daemon = True
+        self.writer.start()
+
+        _open_sinks.add(self)
+        _install_handlers()
+
+    def _buffer(self):
+        return [array(code, [0]) * self.batch for code in self.typecodes]
+
+    def append(self, *row):
+        "Store one row of samples"
+        n = self.n
+        for column, value in zip(self.columns, row):
+            column[n] = value
+        self.n = n + 1
+        if self.n == self.batch or time() - self.flushed >= self.flush_sec:
+            self.flush()
+
+    def flush(self, wait=False):
+        """Hand the rows so far to the writer, and with WAIT, wait until
+           it has written them"""
+        self.flushed = time()
+        if self.n:
+            self.full.put((self.columns, self.n))
+            try:
+                self.columns = self.spare.get_nowait()
+            except Queue.Empty:
+                self.columns = self._buffer()
+            self.n = 0
+        if wait:
+            self.full.join()
+
+    def _write(self):
+        line = self.line
+        while True:
+            item = self.full.get()
+            if item is None:
+                self.full.task_done()
+                break
+            (columns, n) = item
+            rows = zip(*[column[:n] for column in columns])
+            self.out.write(''.join([line % row for row in rows]))
+            self.out.flush()
+            self.spare.put(columns)
+            self.full.task_done()
+
+    def close(self):
+        "Write out everything appended, and close the file"
+        if self.closed:
+            return
+        self.closed = True
+        _open_sinks.discard(self)
+        self.flush()
+        self.full.put(None)
+        self.writer.join()
+        self.out.close()
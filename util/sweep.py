@@ -0,0 +1,153 @@
+"Declarative sweep specs, and planning them into measurement jobs"
+
+import os
+import json
+
+
+class SpecError(Exception):
+    "A sweep spec that can't be read or makes no sense"
+    pass
+
+
+# what a spec's axis varies: each function turns one of the axis'
+# values into the link parameters and/or target of a point
+def _rtt(rtt):
+    return {'link': {'delay': '%dms' % (rtt/2)}}
+
+def _bw(kbps):
+    return {'link': {'bw': kbps/1000.0}}
+
+def _bdp((kBps, rtt)):
+    # make sure its KBps, not Kbps
+    return {'link': {'bw': kBps/125.0, 'delay': '%dms' % (rtt/2)}}
+
+def _target(target):
+    return {'target': target}
+
+AXES = {'rtt': _rtt, 'bw': _bw, 'bdp': _bdp, 'target': _target}
+
+
+def load_spec(path):
+    "Read a sweep spec from a JSON file, or a YAML one if PyYAML is installed"
+    with open(path) as f:
+        if path.endswith(('.yaml', '.yml')):
+            try:
+                import yaml
+            except ImportError:
+                raise SpecError("%s: reading YAML specs needs PyYAML" % path)
+            spec = yaml.safe_load(f)
+        else:
+            spec = json.load(f)
+    spec.setdefault('name', os.path.splitext(os.path.basename(path))[0])
+    return spec
+
+
+def find_spec(name, sweeps_dir='sweeps'):
+    "Path of the spec called NAME in SWEEPS_DIR, or NAME itself if it's a file"
+    if os.path.isfile(name):
+        return name
+    for ext in ('.json', '.yaml', '.yml'):
+        path = os.path.join(sweeps_dir, name + ext)
+        if os.path.isfile(path):
+            return path
+    raise SpecError("no sweep spec %s in %s" % (name, sweeps_dir))
+
+
+def mean(times):
+    "Average of the samples that didn't fail"
+    times = [t for t in times if t is not None]
+    return sum(times) / len(times)
+
+
+class Point(object):
+    "One x value of a sweep: a link shape and a target to fetch over it"
+
+    def __init__(self, x, link, target, runs):
+        self.x = x
+        self.link = dict((str(k), v) for k, v in link.items())
+        self.target = target
+        self.runs = runs
+
+    def job(self, cwnd):
+        "Key of the job measuring this point at CWND"
+        return json.dumps({'link': self.link, 'target': str(self.target),
+                           'runs': self.runs, 'cwnd': cwnd}, sort_keys=True)
+
+    def __str__(self):
+        return 'x=%s target=%s %s' % (self.x, self.target,
+            ' '.join('%s=%s' % kv for kv in sorted(self.link.items())))
+
+
+class Sweep(object):
+    """A spec expanded into its points.
+
+       A spec has either an "axis" (one of AXES) and its "values", or
+       explicit "points", each with an "x" and optionally a "link" and
+       "target".  Besides those it can set "title", "output" (file name
+       of the graph), "x_units", "y_units", "x_labels" (graph x values,
+       if not the values themselves), "cwnds" (the improvement is that
+       of the last over the first), "runs", "retries", and the "link"
+       and "target" every point starts from."""
+
+    def __init__(self, spec, link=None, target=None, runs=None):
+        """spec: a loaded spec
+           link, target, runs: what the spec doesn't set itself"""
+        self.name = spec['name']
+        self.title = spec.get('title', self.name)
+        self.output = spec.get('output', self.name)
+        self.x_units = spec.get('x_units', 'x units')
+        self.y_units = spec.get('y_units', 'y units')
+        self.cwnds = spec.get('cwnds', [3, 10])
+        self.runs = spec.get('runs', runs)
+        self.retries = spec.get('retries', 0)
+
+        base_link = dict(link or {})
+        base_link.update(spec.get('link', {}))
+        base_target = spec.get('target', target)
+
+        if 'axis' in spec:
+            if spec['axis'] not in AXES:
+                raise SpecError("%s: unknown axis %s" % (self.name, spec['axis']))
+            entries = []
+            for value in spec['values']:
+                entry = AXES[spec['axis']](value)
+                entry['x'] = value
+                entries.append(entry)
+        else:
+            entries = spec.get('points', [])
+
+        self.points = []
+        for entry in entries:
+            plink = dict(base_link)
+            plink.update(entry.get('link', {}))
+            self.points.append(Point(entry['x'], plink,
+                                     entry.get('target', base_target), self.runs))
+
+        self.x_values = spec.get('x_labels') or [p.x for p in self.points]
+        if len(self.x_values) != len(self.points):
+            raise SpecError("%s: %d x_labels for %d points" %
+                            (self.name, len(self.x_values), len(self.points)))
+
+    def plan(self, results):
+        """The points still to measure, each (point, cwnds it lacks),
+           leaving out the ones RESULTS has and duplicate points"""
+        todo = []
+        seen = set()
+        for point in self.points:
+            missing = [c for c in self.cwnds if point.job(c) not in results]
+            if missing and point.job(None) not in seen:
+                seen.add(point.job(None))
+                todo.append((point, missing))
+        return todo
+
+    def improvements(self, results):
+        """Absolute (ms) and percentage improvement in average fct of
+           the last cwnd over the first, per point"""
+        abs_improvs = []
+        pct_improvs = []
+        for point in self.points:
+            base = mean(results[point.job(self.cwnds[0])])
+            best = mean(results[point.job(self.cwnds[-1])])
+            abs_improvs.append(1000 * (base - best))
+            pct_improvs.append(100 * (base / best - 1))
+        return (abs_improvs, pct_improvs)
@@ -0,0 +1,101 @@
+"Parametrized client/server topologies for the initcwnd experiments"
+
+from mininet.topo import Topo
+
+
+def link_config(bw=None, delay=None, loss=None, max_queue_size=None, **extra):
+    """TCLink options for one link, leaving out the unset ones
+       so a missing value means an unshaped link"""
+    config = {'bw': bw, 'delay': delay, 'loss': loss,
+              'max_queue_size': max_queue_size}
+    config.update(extra)
+    return dict((k, v) for k, v in config.items() if v is not None)
+
+
+class MultiClientTopo(Topo):
+    "N clients and M servers hanging off one switch"
+
+    def __init__(self, clients=1, servers=1, client_links=None,
+                 server_link=None, client_prefix='client',
+                 server_prefix='server', **params):
+        """clients: number of clients, or a list with one access link
+                    config per client (bw, delay, loss, max_queue_size)
+           servers: number of servers
+           client_links: config shared by every client's access link,
+                    when clients is a number
+           server_link: config of every server's link to the switch,
+                    unshaped by default
+           Hosts are named <prefix>1..<prefix>N; client i is paired
+           with server i modulo M, see pairs()."""
+
+        # Initialize topo
+        Topo.__init__(self, **params)
+
+        if isinstance(clients, (int, long)):
+            clients = [client_links or {}] * clients
+        self.client_links = [link_config(**c) for c in clients]
+        self.server_link = link_config(**(server_link or {}))
+
+        self.clients = ['%s%d' % (client_prefix, i + 1)
+                        for i in range(len(self.client_links))]
+        self.servers = ['%s%d' % (server_prefix, i + 1)
+                        for i in range(servers)]
+
+        # Create the actual topology
+        switch = self.add_switch('s1')
+        port = 1
+        for name in self.servers:
+            server = self.add_host(name)
+            self.add_link(server, switch, port1=0, port2=port,
+                          **self.server_link)
+            port += 1
+        for name, lconfig in zip(self.clients, self.client_links):
+            client = self.add_host(name)
+            self.add_link(client, switch, port1=0, port2=port, **lconfig)
+            port += 1
+
+    def pairs(self):
+        "(client, server) name pairs, spreading the clients over the servers"
+        return [(client, self.servers[i % len(self.servers)])
+                for i, client in enumerate(self.clients)]
+
+
+class PairsTopo(Topo):
+    "Isolated client/server pairs, each pair on a switch of its own"
+
+    def __init__(self, pairs=1, link=None, cpu=None, cores=None, **params):
+        """pairs: number of client/server pairs
+           link: config of each server's (bottleneck) link to its switch
+           cpu: system fraction for each host, when run with CPULimitedHost
+           cores: cores to pin the pairs to, one pair per core in turn
+           Pair i is client<i>, server<i> and switch s<i>."""
+
+        # Initialize topo
+        Topo.__init__(self, **params)
+
+        lconfig = link_config(**(link or {}))
+        self.clients = []
+        self.servers = []
+        self.pair_switches = []
+
+        for i in range(1, pairs + 1):
+            hconfig = {}
+            if cpu is not None:
+                hconfig['cpu'] = cpu
+            if cores:
+                hconfig['cores'] = cores[(i - 1) % len(cores)]
+
+            client = self.add_host('client%d' % i, **hconfig)
+            server = self.add_host('server%d' % i, **hconfig)
+            switch = self.add_switch('s%d' % i)
+
+            self.add_link(client, switch, port1=0, port2=1)
+            self.add_link(server, switch, port1=0, port2=2, **lconfig)
+
+            self.clients.append(client)
+            self.servers.append(server)
+            self.pair_switches.append(switch)
+
+    def pairs(self):
+        "(client, server) name pairs"
+        return zip(self.clients, self.servers)